@@ -0,0 +1,9 @@
+"""Stand-in for unmanic.libs.common so plugin modules can be imported without an Unmanic installation."""
+import os
+import tempfile
+
+_home_dir = os.environ.get("BENCH_HOME_DIR") or tempfile.mkdtemp(prefix="kmarius-bench-")
+
+
+def get_home_dir() -> str:
+    return _home_dir
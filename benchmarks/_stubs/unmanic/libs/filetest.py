@@ -0,0 +1,31 @@
+"""Stand-in for unmanic.libs.filetest without Unmanic's plugin runner.
+
+Every file counts as tested and none needs processing, so a panel test job finishes with nothing queued. The tested
+paths are recorded in tested.
+"""
+import queue
+import threading
+
+
+class FileTesterThread(threading.Thread):
+    def __init__(self, name, files_to_test, files_to_process, status_updates, library_id, event):
+        super().__init__(name=name)
+        self.files_to_test = files_to_test
+        self.files_to_process = files_to_process
+        self.status_updates = status_updates
+        self.library_id = library_id
+        self.event = event
+        self.tested = []
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                path = self.files_to_test.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            self.tested.append(path)
+            self.status_updates.put(path)
@@ -0,0 +1,41 @@
+"""Stand-in for unmanic.libs.libraryscanner, the panel looks the running scanner thread up by name.
+
+Queued paths are recorded in queued instead of creating tasks. Start the thread to make it visible to the panel.
+"""
+import threading
+
+
+class _Settings:
+    @staticmethod
+    def get_concurrent_file_testers() -> int:
+        return 1
+
+
+class _FrontendMessages:
+    def __init__(self):
+        self.items = {}
+
+    def update(self, item: dict):
+        self.items[item["id"]] = item
+
+    def remove_item(self, item_id: str):
+        self.items.pop(item_id, None)
+
+
+class LibraryScannerManager(threading.Thread):
+    def __init__(self, data_queues=None, event=None):
+        super().__init__(name="LibraryScannerManager", daemon=True)
+        self.settings = _Settings()
+        self.event = event if event is not None else threading.Event()
+        self.data_queues = data_queues if data_queues is not None else {"frontend_messages": _FrontendMessages()}
+        self.queued = []
+        self._stopped = threading.Event()
+
+    def add_path_to_queue(self, pathname, library_id, priority_score):
+        self.queued.append((pathname, library_id, priority_score))
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        self._stopped.wait()
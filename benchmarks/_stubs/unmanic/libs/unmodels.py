@@ -0,0 +1,51 @@
+"""Stand-in for the peewee models of unmanic.libs.unmodels, backed by plain lists.
+
+Only the query shapes used by the plugins are supported: select().where(Field == value), Field.in_(values) and first().
+Benchmarks fill the rows class attribute of a model.
+"""
+
+
+class _Field:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __eq__(self, other):
+        return lambda row: getattr(row, self.name) == other
+
+    def in_(self, values):
+        values = set(values)
+        return lambda row: getattr(row, self.name) in values
+
+    __hash__ = object.__hash__
+
+
+class _Query(list):
+    def where(self, *conditions):
+        return _Query(row for row in self if all(condition(row) for condition in conditions))
+
+    def first(self):
+        return self[0] if len(self) > 0 else None
+
+
+class _Model:
+    rows: list = []
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    @classmethod
+    def select(cls, *fields):
+        return _Query(cls.rows)
+
+
+class Libraries(_Model):
+    rows = []
+    id = _Field("id")
+    name = _Field("name")
+    path = _Field("path")
+    enable_remote_only = _Field("enable_remote_only")
+
+
+class Tasks(_Model):
+    rows = []
+    abspath = _Field("abspath")
@@ -0,0 +1,42 @@
+"""Stand-in for unmanic.libs.unplugins.settings.
+
+Settings are the defaults of the plugin, updated with the values in PluginSettings.configured. Unmanic reads the
+settings file of a plugin whenever its settings are instantiated, load_latency (in seconds) emulates that.
+"""
+import time
+
+
+class PluginSettings:
+    settings = {}
+    form_settings = {}
+
+    # values that differ from the defaults, shared by all plugins
+    configured = {}
+    load_latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        self.library_id = kwargs.get("library_id")
+        self.settings_configured = None
+        if PluginSettings.load_latency > 0:
+            time.sleep(PluginSettings.load_latency)
+
+    def _PluginSettings__import_configured_settings(self):
+        self.settings_configured = {**self.settings, **PluginSettings.configured}
+
+    def get_setting(self, key=None):
+        if self.settings_configured is None:
+            self._PluginSettings__import_configured_settings()
+        if key is None:
+            return self.settings_configured
+        return self.settings_configured.get(key)
+
+    def set_setting(self, key, value):
+        PluginSettings.configured[key] = value
+        self.settings_configured = None
+        return True
+
+    def get_form_settings(self):
+        return self.form_settings
+
+    def reset_settings_to_defaults(self):
+        return True
@@ -0,0 +1,95 @@
+"""Per-file overhead of the kmarius_cache_metadata file test, settings per file vs. memoized per library.
+
+All metadata is cached, so the hook only looks up the cache. Settings are loaded through the stand-in in _stubs/ with
+an emulated latency for reading Unmanic's settings.
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+
+os.environ.setdefault("BENCH_HOME_DIR", tempfile.mkdtemp(prefix="kmarius-settings-"))
+
+from common import generate_library, timed
+
+from unmanic.libs.unplugins.settings import PluginSettings
+
+from kmarius_cache_metadata import plugin
+from kmarius_cache_metadata.lib import cache, logger
+from kmarius_cache_metadata.lib.metadata_provider import PROVIDERS
+
+LIBRARY_ID = 1
+
+
+# the hook before settings were memoized
+def legacy_hook(data: dict):
+    settings = plugin.Settings(library_id=data["library_id"])
+
+    path = data["path"]
+    mtime = int(os.path.getmtime(path))
+    quiet = settings.get_setting("quiet_caching")
+
+    for provider in PROVIDERS:
+        if not settings.get_setting(f"enable_{provider.name}_caching"):
+            continue
+
+        res = cache.get(provider.name, path, mtime, reuse_connection=True)
+        if res:
+            if not quiet:
+                logger.info(f"Cached {provider.name} data found - {path}")
+            data["shared_info"][provider.name] = res
+
+
+def run(hook, paths: list[str]):
+    for path in paths:
+        hook({"library_id": LIBRARY_ID, "path": path, "shared_info": {}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--settings-latency", type=float, nargs="+", default=[0.0, 0.5],
+                        help="latency of loading plugin settings in ms")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--profile", action="store_true", help="print a profile of both hooks to stderr")
+    args = parser.parse_args()
+
+    root = os.path.join(os.environ["BENCH_HOME_DIR"], "library")
+    os.makedirs(root, exist_ok=True)
+    generate_library(root, args.files)
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        paths += [os.path.join(dirpath, name) for name in filenames]
+    for path in paths:
+        mtime = int(os.path.getmtime(path))
+        for provider in PROVIDERS:
+            cache.put(provider.name, path, mtime, {"format": {"filename": path}})
+    PluginSettings.configured["quiet_caching"] = True
+
+    results = {"files": len(paths), "runs": []}
+    for latency in args.settings_latency:
+        PluginSettings.load_latency = latency / 1000
+        plugin._resolved_settings.clear()
+        legacy_ms = timed(run, legacy_hook, paths, repeat=args.repeat)
+        memoized_ms = timed(run, plugin.on_library_management_file_test, paths, repeat=args.repeat)
+        results["runs"].append({
+            "settings_latency_ms": latency,
+            "legacy_us_per_file":   legacy_ms * 1000 / len(paths),
+            "memoized_us_per_file": memoized_ms * 1000 / len(paths),
+        })
+
+        if args.profile:
+            for name, hook in [("legacy", legacy_hook), ("memoized", plugin.on_library_management_file_test)]:
+                print(f"--- {name}, settings latency {latency} ms", file=sys.stderr)
+                profiler = cProfile.Profile()
+                profiler.runcall(run, hook, paths)
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(8)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
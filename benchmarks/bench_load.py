@@ -0,0 +1,284 @@
+"""Drive the file test and postprocessor hooks of the plugins from many threads, like Unmanic's file testers do.
+
+Every file runs through the file test hooks in plugin priority order: kmarius_incremental_scan,
+kmarius_cache_metadata and kmarius_incremental_scan_db. The chain stops at the first hook that decides not to add
+the file, as Unmanic does. Metadata providers are replaced by a fake probe with a fixed latency. Meanwhile a separate
+thread emulates the postprocessor by reporting finished tasks.
+
+The first pass finds every file new, the second pass finds every file unchanged. Database write time is the time spent
+in statements that modify a database and in commits, which under contention is mostly waiting for the database lock.
+"""
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import typing
+
+# unmanic runs on python 3.12, the plugins use typing.override
+if not hasattr(typing, "override"):
+    typing.override = lambda f: f
+
+os.environ.setdefault("BENCH_HOME_DIR", tempfile.mkdtemp(prefix="kmarius-load-"))
+
+from common import generate_library
+
+from unmanic.libs.unmodels import Libraries
+from unmanic.libs.unplugins.settings import PluginSettings
+
+LIBRARY_ID = 1
+LIBRARY_ROOT = os.path.join(os.environ["BENCH_HOME_DIR"], "library")
+Libraries.rows = [Libraries(id=LIBRARY_ID, name="library", path=LIBRARY_ROOT, enable_remote_only=False)]
+
+_WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def error(self, name: str):
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self) -> dict:
+        res = {}
+        for name, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            res[name] = {
+                "count":    len(samples),
+                "total_ms": sum(samples) * 1000,
+                "p50_ms":   _percentile(samples, 50) * 1000,
+                "p99_ms":   _percentile(samples, 99) * 1000,
+            }
+        return res
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    if len(samples) == 0:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+recorder = Recorder()
+
+
+def _timed_write(db: str, sql: str, f, *args):
+    if not sql.lstrip().upper().startswith(_WRITE_STATEMENTS):
+        return f(*args)
+    t0 = time.perf_counter()
+    try:
+        return f(*args)
+    finally:
+        recorder.add(f"db_write:{db}", time.perf_counter() - t0)
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        return _timed_write(self.connection.db_name, sql, super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return _timed_write(self.connection.db_name, sql, super().executemany, sql, *args)
+
+
+class TimedConnection(sqlite3.Connection):
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.db_name = os.path.basename(database)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        return _timed_write(self.db_name, "UPDATE", super().commit)
+
+    def __exit__(self, *args):
+        return _timed_write(self.db_name, "UPDATE", super().__exit__, *args)
+
+
+_connect = sqlite3.connect
+
+
+def _timed_connect(database, *args, **kwargs):
+    kwargs.setdefault("factory", TimedConnection)
+    return _connect(database, *args, **kwargs)
+
+
+sqlite3.connect = _timed_connect
+
+
+def load_plugins(probe_latency: float):
+    from kmarius_incremental_scan import plugin as incremental_scan
+    from kmarius_cache_metadata import plugin as cache_metadata
+    from kmarius_cache_metadata.lib import metadata_provider
+    from kmarius_incremental_scan_db import plugin as incremental_scan_db
+
+    def fake_probe(path: str):
+        time.sleep(probe_latency)
+        return {"format": {"filename": path}, "streams": []}
+
+    for provider in metadata_provider.PROVIDERS:
+        provider.run_prog = staticmethod(fake_probe)
+
+    return incremental_scan, cache_metadata, incremental_scan_db
+
+
+def file_test_data(path: str) -> dict:
+    return {
+        "library_id":                LIBRARY_ID,
+        "path":                      path,
+        "issues":                    [],
+        "add_file_to_pending_tasks": None,
+        "priority_score":            0,
+        "shared_info":               {},
+    }
+
+
+def run_pass(hooks: list, paths: list[str], num_threads: int, post_rate: float, postprocessor) -> dict:
+    files = queue.Queue()
+    for path in paths:
+        files.put(path)
+    passed = []
+    passed_lock = threading.Lock()
+    done = threading.Event()
+
+    def tester():
+        while True:
+            try:
+                path = files.get_nowait()
+            except queue.Empty:
+                return
+            data = file_test_data(path)
+            t0 = time.perf_counter()
+            for name, hook in hooks:
+                t1 = time.perf_counter()
+                try:
+                    hook(data)
+                except Exception:
+                    recorder.error(name)
+                recorder.add(f"hook:{name}", time.perf_counter() - t1)
+                if data["add_file_to_pending_tasks"] is False:
+                    break
+            recorder.add("file_test", time.perf_counter() - t0)
+            if data["add_file_to_pending_tasks"] is not False:
+                with passed_lock:
+                    passed.append(path)
+
+    def postprocessor_thread():
+        # report tasks for files that passed the file test, as if they were transcoded in place
+        i = 0
+        while not done.is_set():
+            with passed_lock:
+                path = passed[i] if i < len(passed) else None
+            if path is None:
+                time.sleep(0.01)
+                continue
+            i += 1
+            data = {
+                "library_id":                 LIBRARY_ID,
+                "task_processing_success":    True,
+                "file_move_processes_success": True,
+                "destination_files":          [path],
+            }
+            t0 = time.perf_counter()
+            try:
+                postprocessor(data)
+            except Exception:
+                recorder.error("postprocessor")
+            recorder.add("hook:postprocessor", time.perf_counter() - t0)
+            time.sleep(1 / post_rate)
+
+    threads = [threading.Thread(target=tester) for _ in range(num_threads)]
+    post_thread = threading.Thread(target=postprocessor_thread, daemon=True)
+    t0 = time.perf_counter()
+    if post_rate > 0:
+        post_thread.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    if post_rate > 0:
+        post_thread.join()
+
+    return {
+        "files":          len(paths),
+        "passed":         len(passed),
+        "seconds":        elapsed,
+        "files_per_sec":  len(paths) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--probe-latency", type=float, default=0.0, help="fake metadata probe latency in ms")
+    parser.add_argument("--settings-latency", type=float, default=0.0,
+                        help="latency of loading plugin settings in ms")
+    parser.add_argument("--post-rate", type=float, default=50, help="postprocessor reports per second, 0 to disable")
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    os.makedirs(LIBRARY_ROOT, exist_ok=True)
+    generate_library(LIBRARY_ROOT, args.files, args.depth)
+    paths = []
+    for dirpath, _, filenames in os.walk(LIBRARY_ROOT):
+        paths += [os.path.join(dirpath, name) for name in filenames]
+
+    incremental_scan, cache_metadata, incremental_scan_db = load_plugins(args.probe_latency / 1000)
+    PluginSettings.load_latency = args.settings_latency / 1000
+    hooks = [
+        ("kmarius_incremental_scan", incremental_scan.on_library_management_file_test),
+        ("kmarius_cache_metadata", cache_metadata.on_library_management_file_test),
+        ("kmarius_incremental_scan_db", incremental_scan_db.on_library_management_file_test),
+    ]
+
+    from kmarius_cache_metadata.lib import cache
+    from kmarius_incremental_scan.lib import timestamps
+
+    results = {
+        "parameters": {**vars(args), "files": len(paths)},
+        "runs":       [],
+    }
+    for num_threads in args.threads:
+        # every run starts with empty databases
+        for db_path in [timestamps.DB_PATH, cache.DB_PATH]:
+            if os.path.exists(db_path):
+                os.remove(db_path)
+        timestamps.init()
+        cache.init([provider.name for provider in cache_metadata.PROVIDERS])
+
+        run = {"threads": num_threads}
+        for name in ["first_scan", "rescan"]:
+            recorder.__init__()
+            stats = run_pass(hooks, paths, num_threads, args.post_rate, incremental_scan.on_postprocessor_task_results)
+            run[name] = {**stats, "latency": recorder.summary(), "errors": recorder.errors}
+        results["runs"].append(run)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
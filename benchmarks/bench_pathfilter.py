@@ -0,0 +1,81 @@
+"""Compare the per-pattern ignore loop the panel used before with the compiled PathFilter."""
+import argparse
+import json
+import os
+import random
+import re
+
+from common import timed
+
+from kmarius_incremental_scan.lib.pathfilter import PathFilter
+
+EXTENSIONS = "mkv, mp4, avi, m4v, webm, ts"
+
+PATTERN_SETS = {
+    "none":     [],
+    "typical":  [r"/Extras/", r"/Featurettes/", r"/Sample/", r"\.part$", r"(?i)trailer"],
+    "literals": [f"/Excluded Show {i:02d}/" for i in range(40)],
+    "mixed":    [f"/Excluded Show {i:02d}/" for i in range(30)] + [
+        r"/Season \d+/Extras/", r"-sample\.\w+$", r"\.(nfo|txt|jpg)$", r"/@eaDir/", r"/\.grab/",
+        r"/Specials/.*\.ts$", r"\(\d{4}\) - Copy", r"/tmp/", r"/incomplete/", r"\.!qB$",
+    ],
+}
+
+
+def generate_paths(n: int) -> list[str]:
+    rng = random.Random(42)
+    extensions = ["mkv", "mp4", "nfo", "jpg", "srt", "avi"]
+    paths = []
+    for i in range(n):
+        show = rng.randrange(100)
+        season = rng.randrange(1, 10)
+        ext = rng.choice(extensions)
+        paths.append(f"/media/tv/Show {show:02d}/Season {season:02d}/Show {show:02d} - S{season:02d}E{i % 24:02d}.{ext}")
+    return paths
+
+
+# the checks Panel._is_in_library did before PathFilter
+class LegacyFilter:
+    def __init__(self, extensions: str, patterns: list[str]):
+        exts = [ext.strip().lstrip(".") for ext in extensions.split(",")]
+        self.extensions = [ext for ext in exts if ext != ""] or None
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+
+    def matches(self, path: str) -> bool:
+        if self.extensions:
+            _, ext = os.path.splitext(path)
+            if ext.lstrip(".").lower() not in self.extensions:
+                return False
+        for pattern in self.patterns:
+            if pattern.search(path):
+                return False
+        return True
+
+
+def run(filter_, paths: list[str]) -> int:
+    matches = filter_.matches
+    return sum(1 for path in paths if matches(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paths", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    paths = generate_paths(args.paths)
+    results = {"paths": args.paths}
+    for name, patterns in PATTERN_SETS.items():
+        legacy = LegacyFilter(EXTENSIONS, patterns)
+        compiled = PathFilter.from_settings(EXTENSIONS, "\n".join(patterns))
+        assert run(legacy, paths) == run(compiled, paths)
+        results[name] = {
+            "patterns":    len(patterns),
+            "legacy_ms":   timed(run, legacy, paths, repeat=args.repeat),
+            "compiled_ms": timed(run, compiled, paths, repeat=args.repeat),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
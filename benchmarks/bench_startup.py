@@ -0,0 +1,85 @@
+"""Time importing and re-importing the plugin modules, as Unmanic does whenever plugin settings change.
+
+Reports the first import, the average of re-imports and the first file test after a re-import, which pays for
+whatever initialization was deferred.
+"""
+import argparse
+import importlib
+import json
+import os
+import tempfile
+import time
+import typing
+
+# unmanic runs on python 3.12, the plugins use typing.override
+if not hasattr(typing, "override"):
+    typing.override = lambda f: f
+
+os.environ.setdefault("BENCH_HOME_DIR", tempfile.mkdtemp(prefix="kmarius-startup-"))
+
+from common import generate_library
+
+from unmanic.libs.unmodels import Libraries
+
+PLUGINS = ["kmarius_incremental_scan.plugin", "kmarius_cache_metadata.plugin"]
+
+
+def file_test_data(path: str) -> dict:
+    return {
+        "library_id":                1,
+        "path":                      path,
+        "issues":                    [],
+        "add_file_to_pending_tasks": None,
+        "priority_score":            0,
+        "shared_info":               {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--libraries", type=int, default=10)
+    parser.add_argument("--reloads", type=int, default=50)
+    args = parser.parse_args()
+
+    root = os.path.join(os.environ["BENCH_HOME_DIR"], "library")
+    os.makedirs(root, exist_ok=True)
+    generate_library(root, 10, depth=0)
+    path = os.path.join(root, sorted(os.listdir(root))[0])
+    Libraries.rows = [Libraries(id=i + 1, name=f"library {i + 1}", path=root, enable_remote_only=False)
+                      for i in range(args.libraries)]
+
+    from kmarius_cache_metadata.lib import metadata_provider
+    for provider in metadata_provider.PROVIDERS:
+        provider.run_prog = staticmethod(lambda p: {"format": {"filename": p}})
+
+    results = {"libraries": args.libraries}
+    for name in PLUGINS:
+        t0 = time.perf_counter()
+        module = importlib.import_module(name)
+        first_import = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for _ in range(args.reloads):
+            module = importlib.reload(module)
+        reload_time = (time.perf_counter() - t0) / args.reloads
+
+        t0 = time.perf_counter()
+        module.on_library_management_file_test(file_test_data(path))
+        first_test = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        module.on_library_management_file_test(file_test_data(path))
+        second_test = time.perf_counter() - t0
+
+        results[name] = {
+            "first_import_ms":      first_import * 1000,
+            "reimport_ms":          reload_time * 1000,
+            "first_file_test_ms":   first_test * 1000,
+            "second_file_test_ms":  second_test * 1000,
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Payload size and serialization time of a full /subtree response, nested objects vs. the compact columnar format.
+
+The compact time includes converting the tree. Unmanic serializes the response with json.dumps, the gzip size is what
+a compressing proxy would send.
+"""
+import argparse
+import gzip
+import json
+import os
+import tempfile
+
+os.environ.setdefault("BENCH_HOME_DIR", tempfile.mkdtemp(prefix="kmarius-format-"))
+
+from common import generate_library, timed
+
+from unmanic.libs.unmodels import Libraries
+
+from kmarius_incremental_scan.lib import panel as panel_module, timestamps
+from kmarius_incremental_scan.lib.panel import Panel
+
+from bench_suite import BenchSettings, LIBRARY_ID, list_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=50_000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--dirs", type=int, default=4, help="directories per level")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    root = os.path.join(os.environ["BENCH_HOME_DIR"], "library")
+    os.makedirs(root, exist_ok=True)
+    generate_library(root, args.files, args.depth, args.dirs)
+    paths = list_files(root)
+    timestamps.put_many([(LIBRARY_ID, path, 1700000000) for path in paths])
+
+    Libraries.rows = [Libraries(id=LIBRARY_ID, name="library", path=root, enable_remote_only=False)]
+    panel = Panel(BenchSettings)
+    subtree = panel._load_subtree(root, "library", LIBRARY_ID, lazy=False, hide_empty=True,
+                                  preload_timestamps=True)
+
+    def serialize_nested():
+        return json.dumps(subtree)
+
+    def serialize_compact():
+        return json.dumps(panel_module._to_compact(subtree))
+
+    results = {"parameters": {**vars(args), "files": len(paths)}}
+    for name, serialize in [("nested", serialize_nested), ("compact", serialize_compact)]:
+        payload = serialize().encode("utf-8")
+        results[name] = {
+            "bytes":        len(payload),
+            "gzip_bytes":   len(gzip.compress(payload, compresslevel=6)),
+            "serialize_ms": timed(serialize, repeat=args.repeat),
+        }
+    results["size_ratio"] = results["compact"]["bytes"] / results["nested"]["bytes"]
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
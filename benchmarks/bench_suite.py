@@ -0,0 +1,162 @@
+"""Benchmark the timestamp database and panel operations on a synthetic library.
+
+Runs against the stand-ins in _stubs/ unless Unmanic is installed. The database lives in a temporary home directory.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from common import generate_library, inject_latency, timed
+
+from unmanic.libs.unmodels import Libraries
+
+from kmarius_incremental_scan.lib import dirindex, timestamps
+from kmarius_incremental_scan.lib.jobs import Job
+from kmarius_incremental_scan.lib.panel import Panel
+
+LIBRARY_ID = 1
+
+
+class BenchSettings:
+    """Settings of a single library that shows all files."""
+
+    def __init__(self, *args, **kwargs):
+        self.configured_for = [LIBRARY_ID]
+        self.values = {
+            f"library_{LIBRARY_ID}_extensions":    "",
+            f"library_{LIBRARY_ID}_ignored_paths": "",
+            f"library_{LIBRARY_ID}_hide_empty":    True,
+            f"library_{LIBRARY_ID}_prune_ignored": False,
+            f"library_{LIBRARY_ID}_lazy_load":     False,
+            "watch_libraries":                     False,
+            "panel_job_workers":                   1,
+            "prune_mode":                          "stat",
+            "change_detection":                    "mtime",
+        }
+
+    def get_setting(self, key):
+        return self.values.get(key)
+
+
+def list_files(root: str) -> list[str]:
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        paths += [os.path.join(dirpath, name) for name in filenames]
+    return sorted(paths)
+
+
+def bench_timestamps(paths: list[str], repeat: int, lookups: int) -> dict:
+    rng = random.Random(42)
+    values = [(LIBRARY_ID, path, 1700000000) for path in paths]
+    sample = rng.sample(paths, min(lookups, len(paths)))
+    per_dir = {}
+    for path in paths:
+        per_dir.setdefault(os.path.dirname(path), []).append(path)
+    dirs = rng.sample(list(per_dir.values()), min(lookups, len(per_dir)))
+
+    def get_each():
+        for path in sample:
+            timestamps.get(LIBRARY_ID, path, reuse_connection=True)
+
+    def get_many_per_dir():
+        for files in dirs:
+            timestamps.get_many(LIBRARY_ID, files)
+
+    def remove_all():
+        for i in range(0, len(paths), 1000):
+            timestamps.remove_paths(LIBRARY_ID, paths[i:i + 1000])
+
+    results = {
+        "put_many_ms": timed(timestamps.put_many, values),
+    }
+    results["get_us"] = timed(get_each, repeat=repeat) * 1000 / len(sample)
+    results["get_many_dir_ms"] = timed(get_many_per_dir, repeat=repeat) / len(dirs)
+    results["get_all_ms"] = timed(timestamps.get_all, LIBRARY_ID, repeat=repeat)
+    results["remove_paths_ms"] = timed(remove_all)
+    assert timestamps.count(LIBRARY_ID) == 0
+    return results
+
+
+def bench_panel(panel: Panel, root: str, paths: list[str], latency: float, orphans: int) -> dict:
+    results = {}
+    timestamps.put_many([(LIBRARY_ID, path, 1700000000) for path in paths])
+
+    def load_subtree():
+        cache = timestamps.get_all(LIBRARY_ID)
+        panel._load_subtree(root, "library", LIBRARY_ID, lazy=False, hide_empty=True, timestamp_cache=cache)
+
+    with inject_latency(latency):
+        panel._index = dirindex.DirIndex()
+        results["load_subtree_cold_ms"] = timed(load_subtree)
+        results["load_subtree_warm_ms"] = timed(load_subtree)
+
+        etag = panel._load_subtree(root, "library", LIBRARY_ID, lazy=False, hide_empty=True,
+                                   preload_timestamps=True)["etag"]
+
+        def revalidate_subtree():
+            res = panel._load_subtree(root, "library", LIBRARY_ID, lazy=False, hide_empty=True, etag=etag,
+                                      preload_timestamps=True)
+            assert res.get("not_modified")
+
+        results["load_subtree_not_modified_ms"] = timed(revalidate_subtree)
+
+        for mode in ["stat", "walk"]:
+            orphaned = [os.path.join(root, "gone", f"orphan {i:05d}.mkv") for i in range(orphans)]
+            timestamps.put_many([(LIBRARY_ID, path, 1) for path in orphaned])
+            panel._index = dirindex.DirIndex()
+            job = Job("prune")
+            results[f"prune_{mode}_ms"] = timed(panel._prune_database, {"library_id": LIBRARY_ID, "mode": mode}, job)
+            assert timestamps.count(LIBRARY_ID) == len(paths)
+
+        payload = {"arr": [{"library_id": LIBRARY_ID, "path": root}]}
+        results["update_timestamps_ms"] = timed(panel._update_timestamps, payload, Job("update"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20_000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--dirs", type=int, default=4, help="directories per level")
+    parser.add_argument("--latency", type=float, default=0.0, help="injected latency per fs call in ms")
+    parser.add_argument("--orphans", type=int, default=1000, help="orphaned rows added before pruning")
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        timestamps.DB_PATH = os.path.join(tmp, "timestamps.db")
+        timestamps.init()
+
+        root = os.path.join(tmp, "library")
+        os.makedirs(root)
+        generate_library(root, args.files, args.depth, args.dirs)
+        paths = list_files(root)
+
+        Libraries.rows = [Libraries(id=LIBRARY_ID, name="library", path=root, enable_remote_only=False)]
+        panel = Panel(BenchSettings)
+
+        results = {
+            "time":        time.time(),
+            "python":      sys.version.split()[0],
+            "platform":    platform.platform(),
+            "parameters":  {**vars(args), "files": len(paths)},
+            "timestamps":  bench_timestamps(paths, args.repeat, args.lookups),
+            "panel":       bench_panel(panel, root, paths, args.latency / 1000, args.orphans),
+        }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Compare the flat timestamps table with the normalized directories/files schema."""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+
+from common import timed
+
+from kmarius_incremental_scan.lib import timestamps
+
+
+# the schema and queries timestamps.py used before the directories table
+class FlatStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.execute('''
+                         CREATE TABLE IF NOT EXISTS timestamps
+                         (
+                             library_id INTEGER NULL,
+                             path       TEXT    NOT NULL,
+                             mtime      INTEGER NOT NULL,
+                             PRIMARY KEY (library_id, path)
+                         )''')
+        conn.close()
+
+    def put_many(self, values: list[(int, str, int)]):
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.executemany('''
+                             INSERT INTO timestamps (library_id, path, mtime)
+                             VALUES (?, ?, ?)
+                             ON CONFLICT(library_id, path) DO UPDATE SET mtime = excluded.mtime
+                             ''', values)
+        conn.close()
+
+    def get_all(self, library_id: int) -> dict[str, int]:
+        conn = sqlite3.connect(self.db_path)
+        cur = conn.cursor()
+        cur.execute("SELECT path, mtime FROM timestamps WHERE library_id = ?", (library_id,))
+        res = dict(cur)
+        conn.close()
+        return res
+
+    def get_many(self, library_id: int, paths: list[str]) -> list:
+        conn = sqlite3.connect(self.db_path)
+        cur = conn.cursor()
+        mtimes = []
+        for path in paths:
+            cur.execute("SELECT mtime FROM timestamps WHERE library_id = ? AND path = ?", (library_id, path))
+            row = cur.fetchone()
+            mtimes.append(row[0] if row else None)
+        conn.close()
+        return mtimes
+
+
+class NormalizedStore:
+    def __init__(self, db_path: str):
+        timestamps.DB_PATH = db_path
+        timestamps.init()
+
+    @staticmethod
+    def put_many(values: list[(int, str, int)]):
+        timestamps.put_many(values)
+
+    @staticmethod
+    def get_all(library_id: int) -> dict[str, int]:
+        return timestamps.get_all(library_id)
+
+    @staticmethod
+    def get_many(library_id: int, paths: list[str]) -> list:
+        return timestamps.get_many(library_id, paths)
+
+
+def generate_library(num_files: int, files_per_dir: int) -> dict[str, list[str]]:
+    """Paths of a synthetic tv library, grouped by directory."""
+    rng = random.Random(42)
+    dirs = {}
+    i = 0
+    while i < num_files:
+        show = len(dirs) // 8
+        season = len(dirs) % 8 + 1
+        directory = f"/mnt/storage/media/library/tv shows/Some Fairly Long Show Name {show:04d} (2019)/Season {season:02d}"
+        files = []
+        for episode in range(min(files_per_dir, num_files - i)):
+            files.append(f"{directory}/Some Fairly Long Show Name {show:04d} - S{season:02d}E{episode:02d} - "
+                         f"Episode Title {rng.randrange(10 ** 6):06d} [WEBDL-1080p][EAC3 5.1][h264].mkv")
+        dirs[directory] = files
+        i += len(files)
+    return dirs
+
+
+def db_size(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--files-per-dir", type=int, default=12)
+    parser.add_argument("--lookups", type=int, default=500, help="number of directories to look up")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    library = generate_library(args.files, args.files_per_dir)
+    values = [(1, path, 1700000000) for files in library.values() for path in files]
+    rng = random.Random(1)
+    lookups = rng.sample(list(library.values()), min(args.lookups, len(library)))
+
+    def lookup_dirs(store):
+        for files in lookups:
+            store.get_many(1, files)
+
+    results = {
+        "files":       len(values),
+        "directories": len(library),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, store_cl in [("flat", FlatStore), ("normalized", NormalizedStore)]:
+            db_path = os.path.join(tmp, f"{name}.db")
+            store = store_cl(db_path)
+            insert_ms = timed(store.put_many, values)
+            assert len(store.get_all(1)) == len(values)
+            lookups_ms = timed(lookup_dirs, store, repeat=args.repeat)
+            results[name] = {
+                "db_bytes":      db_size(db_path),
+                "insert_ms":     insert_ms,
+                "get_all_ms":    timed(store.get_all, 1, repeat=args.repeat),
+                "dir_lookup_ms": lookups_ms / len(lookups),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Compare the serial subtree walk with the parallel walker used for non-lazy panel loads."""
+import argparse
+import json
+import os
+import tempfile
+
+from common import generate_tree, inject_latency, timed
+
+from kmarius_incremental_scan.lib import walk
+
+
+# the walk Panel._load_subtree did before the parallel walker: recursive scandir and os.stat per file
+def serial_walk(path: str) -> int:
+    num_files = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            abspath = os.path.abspath(os.path.join(path, entry.name))
+            if entry.is_dir():
+                num_files += serial_walk(abspath)
+            else:
+                os.stat(abspath)
+                num_files += 1
+    return num_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--dirs", type=int, default=4, help="directories per level")
+    parser.add_argument("--files", type=int, default=20, help="files per directory")
+    parser.add_argument("--latency", type=float, default=1.0, help="injected latency per fs call in ms")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        num_files = generate_tree(root, args.depth, args.dirs, args.files)
+        results = {
+            "files":      num_files,
+            "latency_ms": args.latency,
+        }
+        with inject_latency(args.latency / 1000):
+            results["serial_ms"] = timed(serial_walk, root, repeat=args.repeat)
+            for workers in args.workers:
+                results[f"parallel_{workers}_ms"] = timed(walk.walk_parallel, root, workers, repeat=args.repeat)
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import contextlib
+import os
+import sys
+import time
+from unittest import mock
+
+SOURCE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "source"))
+if SOURCE_DIR not in sys.path:
+    sys.path.insert(0, SOURCE_DIR)
+
+# modules that only need small parts of unmanic import against stand-ins if it isn't installed
+try:
+    import unmanic
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "_stubs"))
+
+
+def generate_tree(root: str, depth: int = 3, dirs_per_level: int = 4, files_per_dir: int = 10,
+                  extension: str = ".mkv") -> int:
+    """Create a synthetic library below root and return the number of files created."""
+    num_files = 0
+    for i in range(files_per_dir):
+        with open(os.path.join(root, f"file {i:04d}{extension}"), "w"):
+            num_files += 1
+    if depth > 0:
+        for i in range(dirs_per_level):
+            child = os.path.join(root, f"dir {i:02d}")
+            os.makedirs(child, exist_ok=True)
+            num_files += generate_tree(child, depth - 1, dirs_per_level, files_per_dir, extension)
+    return num_files
+
+
+def generate_library(root: str, num_files: int, depth: int = 3, dirs_per_level: int = 4,
+                     extension: str = ".mkv") -> int:
+    """Create a synthetic library of about num_files files spread evenly over a tree of the given depth."""
+    num_dirs = sum(dirs_per_level ** level for level in range(depth + 1))
+    files_per_dir = max(1, -(-num_files // num_dirs))
+    return generate_tree(root, depth, dirs_per_level, files_per_dir, extension)
+
+
+class _SlowEntry:
+    def __init__(self, entry: os.DirEntry, latency: float):
+        self._entry = entry
+        self._latency = latency
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_dir(self, *, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, *, follow_symlinks=True):
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def stat(self, *, follow_symlinks=True):
+        time.sleep(self._latency)
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+
+class _SlowScandir:
+    def __init__(self, iterator, latency: float):
+        self._iterator = iterator
+        self._latency = latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._iterator.close()
+
+    def __iter__(self):
+        for entry in self._iterator:
+            yield _SlowEntry(entry, self._latency)
+
+
+@contextlib.contextmanager
+def inject_latency(latency: float):
+    """Add latency (in seconds) to every scandir and stat call, emulating a network share."""
+    if latency <= 0:
+        yield
+        return
+
+    scandir = os.scandir
+    stat = os.stat
+
+    def slow_scandir(path="."):
+        time.sleep(latency)
+        return _SlowScandir(scandir(path), latency)
+
+    def slow_stat(path, *args, **kwargs):
+        time.sleep(latency)
+        return stat(path, *args, **kwargs)
+
+    with mock.patch("os.scandir", slow_scandir), mock.patch("os.stat", slow_stat):
+        yield
+
+
+def timed(f, *args, repeat: int = 1, **kwargs) -> float:
+    """Return the best wall time of repeat runs in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        f(*args, **kwargs)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
@@ -0,0 +1,5 @@
+import logging
+
+PLUGIN_ID = "kmarius_cache_metadata"
+
+logger = logging.getLogger(f"Unmanic.Plugin.{PLUGIN_ID}")
\ No newline at end of file
@@ -0,0 +1,89 @@
+import sqlite3
+import os
+import json
+import threading
+import time
+from typing import Optional
+
+from unmanic.libs import common
+
+from . import PLUGIN_ID
+
+# TODO: a way to clean up orphans
+
+DB_PATH = os.path.join(common.get_home_dir(), ".unmanic", "userdata", PLUGIN_ID, "metadata.db")
+
+local = threading.local()
+
+_init_lock = threading.Lock()
+_initialized_tables: set[str] = set()
+
+
+# NOTE: only reuse in short-lived threads like FileTester
+def _get_connection(tables: list[str], reuse_connection=False) -> sqlite3.Connection:
+    ensure_init(tables)
+    if reuse_connection:
+        if not hasattr(local, "connection"):
+            local.connection = sqlite3.connect(DB_PATH)
+
+        return local.connection
+    else:
+        return sqlite3.connect(DB_PATH)
+
+
+def init(tables: list[str]):
+    if not os.path.exists(os.path.dirname(DB_PATH)):
+        os.makedirs(os.path.dirname(DB_PATH))
+
+    conn = sqlite3.connect(DB_PATH)
+    with conn:
+        cur = conn.cursor()
+        for table in tables:
+            cur.execute(f'''
+                           CREATE TABLE IF NOT EXISTS {table} (
+                               path TEXT PRIMARY KEY,
+                               mtime INTEGER NOT NULL,
+                               last_update INTEGER NOT NULL,
+                               data TEXT DEFAULT NULL
+                           )''')
+        conn.commit()
+    conn.close()
+    _initialized_tables.update(tables)
+
+
+# plugins are re-imported whenever settings change, but the tables only need to be created once per process
+def ensure_init(tables: list[str]):
+    if _initialized_tables.issuperset(tables):
+        return
+    with _init_lock:
+        if not _initialized_tables.issuperset(tables):
+            init(tables)
+
+
+def get(table: str, path: str, mtime: int = None, reuse_connection=False) -> Optional[dict]:
+    conn = _get_connection([table], reuse_connection)
+    cur = conn.cursor()
+    if mtime:
+        cur.execute(f"SELECT data FROM {table} WHERE path = ? AND mtime = ? LIMIT 1",
+                    (path, mtime))
+    else:
+        cur.execute(f"SELECT data FROM {table} WHERE path = ? LIMIT 1",
+                    (path,))
+    row = cur.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return json.loads(row[0])
+
+
+def put(table: str, path: str, mtime: int, data: dict, reuse_connection=False):
+    conn = _get_connection([table], reuse_connection)
+    cur = conn.cursor()
+    last_update = int(time.time())
+    cur.execute(f'''
+                INSERT INTO {table} (path, mtime, last_update, data)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (path) DO
+                UPDATE SET
+                    (mtime, last_update, data) = (EXCLUDED.mtime, EXCLUDED.last_update, EXCLUDED.data)
+                ''', (path, mtime, last_update, json.dumps(data)))
+    conn.commit()
\ No newline at end of file
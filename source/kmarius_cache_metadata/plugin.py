@@ -0,0 +1,137 @@
+import json
+import os
+from typing import NamedTuple, Optional
+
+from unmanic.libs.unplugins.settings import PluginSettings
+
+from kmarius_cache_metadata.lib.metadata_provider import MetadataProvider, PROVIDERS
+from kmarius_cache_metadata.lib.plugin_types import *
+from kmarius_cache_metadata.lib import logger, cache
+
+
+class Settings(PluginSettings):
+    @staticmethod
+    def __build_settings():
+        settings = {
+            "quiet_caching":      False,
+            "use_shared_catalog": False,
+        }
+        form_settings = {
+            "quiet_caching":      {
+                'label': "Don't log cache lookups and updates.",
+            },
+            "use_shared_catalog": {
+                'label':       "Store metadata in the shared catalog",
+                'description': "Keep metadata in the timestamp database of kmarius_incremental_scan, which looks up "
+                               "timestamp and metadata of a file at once and prunes orphaned metadata. Existing "
+                               "metadata is copied over the first time.",
+            },
+        }
+
+        settings.update({
+            f"enable_{provider.name}_caching": provider.default_enabled for provider in PROVIDERS
+        })
+
+        form_settings.update({
+            f"enable_{p.name}_caching": {
+                'label': f'Enable {p.name} metadata caching',
+            } for p in PROVIDERS
+        })
+
+        return settings, form_settings
+
+    def __init__(self, *args, **kwargs):
+        super(Settings, self).__init__(*args, **kwargs)
+        self.settings, self.form_settings = self.__build_settings()
+
+    def set_setting(self, key, value):
+        _resolved_settings.clear()
+        return super(Settings, self).set_setting(key, value)
+
+    def reset_settings_to_defaults(self):
+        _resolved_settings.clear()
+        return super(Settings, self).reset_settings_to_defaults()
+
+
+class ResolvedSettings(NamedTuple):
+    quiet: bool
+    providers: list[type[MetadataProvider]]
+    shared_catalog: bool
+
+
+# settings of each library, resolved on the first file test. plugin.py is re-executed when the plugin is reloaded,
+# which starts with an empty cache
+_resolved_settings: dict[int, ResolvedSettings] = {}
+
+
+def get_settings(library_id: int) -> ResolvedSettings:
+    resolved = _resolved_settings.get(library_id)
+    if resolved is None:
+        settings = Settings(library_id=library_id)
+        providers = [provider for provider in PROVIDERS
+                     if settings.get_setting(f"enable_{provider.name}_caching")]
+        shared_catalog = settings.get_setting("use_shared_catalog") and _import_catalog() is not None
+        resolved = ResolvedSettings(settings.get_setting("quiet_caching"), providers, shared_catalog)
+        _resolved_settings[library_id] = resolved
+    return resolved
+
+
+def _import_catalog():
+    try:
+        from kmarius_incremental_scan.lib import catalog
+        return catalog
+    except ImportError as e:
+        logger.error(f"The shared catalog requires kmarius_incremental_scan, falling back to the metadata cache: {e}")
+        return None
+
+
+def _lookup_catalog(catalog, data: FileTestData, providers: list[type[MetadataProvider]]) -> dict[str, Optional[dict]]:
+    """Payloads of the file from the catalog, handed over by kmarius_incremental_scan if it looked them up already."""
+    names = [provider.name for provider in providers]
+    catalog.ensure_providers(names, legacy_db=cache.DB_PATH)
+
+    handoff = data["shared_info"].get(catalog.SHARED_INFO_KEY)
+    if handoff and handoff["library_id"] == data["library_id"] and handoff["path"] == data["path"] \
+            and all(name in handoff["payloads"] for name in names):
+        payloads = handoff["payloads"]
+    else:
+        entry = catalog.lookup(data["library_id"], data["path"], names, reuse_connection=True)
+        payloads = catalog.handoff(data["library_id"], data["path"], entry)["payloads"]
+    return payloads
+
+
+def on_library_management_file_test(data: FileTestData):
+    quiet, providers, shared_catalog = get_settings(data["library_id"])
+
+    path = data["path"]
+    mtime = int(os.path.getmtime(path))
+
+    if shared_catalog:
+        catalog = _import_catalog()
+        payloads = _lookup_catalog(catalog, data, providers)
+
+    for provider in providers:
+        if shared_catalog:
+            payload = payloads[provider.name]
+            res = json.loads(payload["data"]) if payload and payload["mtime"] == mtime and payload["data"] else None
+        else:
+            res = cache.get(provider.name, path, mtime, reuse_connection=True)
+
+        if res:
+            if not quiet:
+                logger.info(f"Cached {provider.name} data found - {path}")
+        else:
+            if not quiet:
+                logger.info(f"No cached {provider.name} data found, refreshing - {path}")
+            res = provider.run_prog(path)
+            if res:
+                if shared_catalog:
+                    catalog.put_payload(data["library_id"], path, provider.name, mtime, res, reuse_connection=True)
+                else:
+                    cache.put(provider.name, path, mtime, res, reuse_connection=True)
+            else:
+                if not quiet:
+                    logger.error(f"Could not retrieve {provider.name} metadata - {path}")
+
+        if res:
+            data["shared_info"][provider.name] = res
\ No newline at end of file
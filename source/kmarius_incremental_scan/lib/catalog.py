@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import NamedTuple, Optional
+
+from unmanic.libs.unmodels import Libraries
+
+from . import logger
+from .fingerprint import Fingerprint
+from .metrics import timed
+from .timestamps import _create_dir_id, _get_connection, _subtree_args, _touch
+
+# key in shared_info under which the file test hands the looked up payloads to the following plugins
+SHARED_INFO_KEY = "incremental_scan_catalog"
+
+_lock = Lock()
+_providers: Optional[set[str]] = None
+
+
+class Payload(NamedTuple):
+    mtime: int
+    data: str
+
+
+class Entry(NamedTuple):
+    fingerprint: Optional[Fingerprint]
+    payloads: dict[str, Optional[Payload]]
+
+
+# the catalog extends the timestamp database with a payload table per provider (e.g. ffprobe output of
+# kmarius_cache_metadata), keyed by the same directory and file name. every payload has a row in files, files that
+# were never tested have no timestamp (mtime NULL) there, unlike reset timestamps (mtime 0). deleting a file, by
+# pruning or forgetting, deletes its payloads by trigger, resetting keeps them
+def _table(provider: str) -> str:
+    if not provider.isidentifier():
+        raise ValueError(f"Invalid provider name: {provider}")
+    return f"payload_{provider}"
+
+
+def get_providers() -> set[str]:
+    """Providers that store payloads in the catalog. Empty unless a plugin enabled the catalog."""
+    global _providers
+    if _providers is None:
+        with _lock:
+            if _providers is None:
+                conn = _get_connection()
+                rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'payload\\_%' "
+                                    "ESCAPE '\\'").fetchall()
+                conn.close()
+                _providers = {row[0].removeprefix("payload_") for row in rows}
+    return _providers
+
+
+def ensure_providers(providers: list[str], legacy_db: str = None):
+    """Create the payload tables of providers, new tables are filled from the table of the same name in legacy_db."""
+    missing = [provider for provider in providers if provider not in get_providers()]
+    if len(missing) == 0:
+        return
+    with _lock:
+        missing = [provider for provider in missing if provider not in _providers]
+        conn = _get_connection()
+        with conn:
+            cur = conn.cursor()
+            for provider in missing:
+                table = _table(provider)
+                cur.execute(f'''
+                            CREATE TABLE IF NOT EXISTS {table}
+                            (
+                                dir_id      INTEGER NOT NULL,
+                                name        TEXT    NOT NULL,
+                                mtime       INTEGER NOT NULL,
+                                last_update INTEGER NOT NULL,
+                                data        TEXT    NULL,
+                                PRIMARY KEY (dir_id, name)
+                            ) WITHOUT ROWID''')
+                cur.execute(f'''
+                            CREATE TRIGGER IF NOT EXISTS {table}_delete
+                                AFTER DELETE
+                                ON files
+                            BEGIN
+                                DELETE FROM {table} WHERE dir_id = OLD.dir_id AND name = OLD.name;
+                            END''')
+                if legacy_db is not None and os.path.exists(legacy_db):
+                    _migrate_legacy_table(cur, legacy_db, provider)
+        conn.close()
+        _providers.update(missing)
+
+
+def _migrate_legacy_table(cur: sqlite3.Cursor, legacy_db: str, provider: str):
+    # legacy rows are keyed by path only, they are copied to every library containing the path and dropped otherwise
+    cur.execute("ATTACH DATABASE ? AS legacy", (legacy_db,))
+    try:
+        if cur.execute("SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = ?",
+                       (provider,)).fetchone() is None:
+            return
+        num_migrated = 0
+        libraries = list(Libraries.select())
+        for library in libraries:
+            _, path, lower, upper = _subtree_args(library.id, library.path)
+            rows = cur.execute(f"SELECT path, mtime, last_update, data FROM legacy.{provider} "
+                               f"WHERE path > ? AND path < ?", (lower, upper)).fetchall()
+            dir_ids = {}
+            for path, mtime, last_update, data in rows:
+                directory, name = os.path.split(path)
+                dir_id = dir_ids.get(directory)
+                if dir_id is None:
+                    dir_id = dir_ids[directory] = _create_dir_id(cur, library.id, directory)
+                cur.execute("INSERT INTO files (dir_id, name, mtime) VALUES (?, ?, NULL) "
+                            "ON CONFLICT(dir_id, name) DO NOTHING", (dir_id, name))
+                cur.execute(f"INSERT OR IGNORE INTO {_table(provider)} (dir_id, name, mtime, last_update, data) "
+                            f"VALUES (?, ?, ?, ?, ?)", (dir_id, name, mtime, last_update, data))
+                num_migrated += 1
+        logger.info(f"Migrated {num_migrated} {provider} entries from {legacy_db}")
+    finally:
+        cur.connection.commit()
+        cur.execute("DETACH DATABASE legacy")
+    _touch([library.id for library in libraries])
+
+
+@timed("timestamps_get_seconds")
+def lookup(library_id: int, path: str, providers: list[str], reuse_connection=False) -> Entry:
+    """Fingerprint of a file and the payloads of providers in a single query."""
+    columns = "".join(f", p{i}.mtime, p{i}.data" for i in range(len(providers)))
+    joins = "".join(f" LEFT JOIN {_table(provider)} p{i} ON p{i}.dir_id = f.dir_id AND p{i}.name = f.name"
+                    for i, provider in enumerate(providers))
+    directory, name = os.path.split(path)
+    conn = _get_connection(reuse_connection)
+    row = conn.execute(f'''
+                       SELECT f.mtime, f.size, f.inode, f.hash{columns}
+                       FROM directories d
+                                JOIN files f ON f.dir_id = d.id{joins}
+                       WHERE d.library_id = ?
+                         AND d.path = ?
+                         AND f.name = ?
+                       ''', (library_id, directory, name)).fetchone()
+    if not reuse_connection:
+        conn.close()
+    if row is None:
+        return Entry(None, {provider: None for provider in providers})
+    # rows without a timestamp only hold payloads, reset rows have mtime 0. neither says anything about the file
+    stored = Fingerprint(*row[:4]) if row[0] else None
+    payloads = {}
+    for i, provider in enumerate(providers):
+        mtime, data = row[4 + 2 * i:6 + 2 * i]
+        payloads[provider] = Payload(mtime, data) if mtime is not None else None
+    return Entry(stored, payloads)
+
+
+def put_payload(library_id: int, path: str, provider: str, mtime: int, data: dict, reuse_connection=False):
+    directory, name = os.path.split(path)
+    conn = _get_connection(reuse_connection)
+    with conn:
+        cur = conn.cursor()
+        dir_id = _create_dir_id(cur, library_id, directory)
+        cur.execute("INSERT INTO files (dir_id, name, mtime) VALUES (?, ?, NULL) "
+                    "ON CONFLICT(dir_id, name) DO NOTHING", (dir_id, name))
+        cur.execute(f'''
+                    INSERT INTO {_table(provider)} (dir_id, name, mtime, last_update, data)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(dir_id, name) DO UPDATE SET mtime       = excluded.mtime,
+                                                            last_update = excluded.last_update,
+                                                            data        = excluded.data
+                    ''', (dir_id, name, mtime, int(time.time()), json.dumps(data)))
+    if not reuse_connection:
+        conn.close()
+    _touch([library_id])
+
+
+def handoff(library_id: int, path: str, entry: Entry) -> dict:
+    """The looked up payloads in the form passed on in shared_info."""
+    return {
+        "library_id": library_id,
+        "path":       path,
+        "payloads":   {provider: payload._asdict() if payload else None
+                       for provider, payload in entry.payloads.items()},
+    }
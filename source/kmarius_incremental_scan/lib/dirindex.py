@@ -0,0 +1,255 @@
+import ctypes
+import ctypes.util
+import itertools
+import os
+import pickle
+import select
+import struct
+import threading
+import time
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from . import logger, walk
+from .walk import DirListing
+
+# delay after the last change before the index is written to disk
+SAVE_DELAY = 30
+
+
+class _Entry(NamedTuple):
+    mtime: Optional[int]
+    listing: DirListing
+    # changes whenever the directory is rescanned, so a listing can be recognized without comparing its contents
+    version: int = 0
+
+
+class DirIndex:
+    """Cache of unfiltered directory listings, revalidated by the mtime of each directory.
+
+    A directory is only rescanned if its mtime changed. Modifying a file in place does not change the mtime of its
+    directory, so file stats can become stale until the directory is refreshed or the watcher reports the change.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None):
+        self._cache_file = cache_file
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._watcher: Optional[Watcher] = None
+        # versions of a previous process are loaded from the cache file, new ones must not collide with them
+        self._versions = itertools.count(time.time_ns())
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if self._cache_file and os.path.exists(self._cache_file):
+            try:
+                with open(self._cache_file, "rb") as file:
+                    self._entries = pickle.load(file)
+                logger.info(f"Loaded {len(self._entries)} cached directories")
+            except Exception as e:
+                logger.error(f"Could not load directory index: {e}")
+                self._entries = {}
+
+    def save(self):
+        with self._lock:
+            self._save_timer = None
+            if not self._cache_file:
+                return
+            entries = dict(self._entries)
+        tmp = self._cache_file + ".tmp"
+        with open(tmp, "wb") as file:
+            pickle.dump(entries, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._cache_file)
+
+    def _schedule_save(self):
+        # called with the lock held
+        if self._cache_file and self._save_timer is None:
+            self._save_timer = threading.Timer(SAVE_DELAY, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def listing(self, path: str, refresh=False) -> DirListing:
+        """Return the listing of a directory, including hidden entries, rescanning it only if it changed."""
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            self._load()
+            entry = self._entries.get(path)
+        if entry is not None and entry.mtime == mtime and not refresh:
+            return entry.listing
+
+        listing = walk.scan_dir(path, include_hidden=True)
+        with self._lock:
+            if entry is not None:
+                for name in set(entry.listing.dirs).difference(listing.dirs):
+                    self._drop(os.path.join(path, name))
+            self._entries[path] = _Entry(mtime, listing, next(self._versions))
+            self._schedule_save()
+        if self._watcher:
+            self._watcher.add(path)
+        return listing
+
+    def version(self, path: str) -> Optional[int]:
+        """Version of the cached listing of a directory, None if it was never listed."""
+        with self._lock:
+            entry = self._entries.get(path)
+        return entry.version if entry is not None else None
+
+    def _drop(self, path: str):
+        # called with the lock held
+        prefix = path + "/"
+        for key in [key for key in self._entries if key == path or key.startswith(prefix)]:
+            del self._entries[key]
+
+    def invalidate(self, path: str):
+        """Force a rescan of the directory on the next access."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries[path] = _Entry(None, entry.listing, entry.version)
+
+    def walk(self, root: str, max_workers: int = 8, prune_dir: Optional[Callable[[str], bool]] = None,
+             include_file: Optional[Callable[[str], bool]] = None, include_hidden=False, refresh=False,
+             cancelled: Optional[Callable[[], bool]] = None) -> dict[str, DirListing]:
+        """Like walk.walk_parallel, but served from the index."""
+
+        def list_dir(path: str) -> DirListing:
+            return self.listing(path, refresh=refresh)
+
+        return walk.walk_parallel(root, max_workers, prune_dir, include_file, include_hidden,
+                                  list_dir=list_dir, cancelled=cancelled)
+
+    def files(self, root: str, max_workers: int = 8, cancelled: Optional[Callable[[], bool]] = None) -> list[str]:
+        """All files below root, including hidden ones."""
+        res = []
+        for path, listing in self.walk(root, max_workers, include_hidden=True, cancelled=cancelled).items():
+            for file in listing.files:
+                res.append(os.path.join(path, file.name))
+        return res
+
+    def iter_files(self, root: str) -> Iterator[str]:
+        """All files below root, including hidden ones, yielded while walking."""
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                listing = self.listing(path)
+            except OSError as e:
+                logger.error(f"{e}")
+                continue
+            for file in listing.files:
+                yield os.path.join(path, file.name)
+            stack.extend(os.path.join(path, name) for name in reversed(listing.dirs))
+
+    def start_watcher(self):
+        if self._watcher is not None:
+            return
+        try:
+            self._watcher = Watcher(self.invalidate)
+        except OSError as e:
+            logger.error(f"Could not start inotify watcher: {e}")
+            return
+        with self._lock:
+            paths = list(self._entries.keys())
+        for path in paths:
+            self._watcher.add(path)
+
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+               | _IN_DELETE_SELF | _IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Watcher:
+    """Minimal inotify wrapper that reports changed directories. Linux only, raises OSError elsewhere."""
+
+    def __init__(self, on_change: Callable[[str], None]):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._on_change = on_change
+        self._paths: dict[int, str] = {}
+        self._watched: set[str] = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kmarius-dirindex-watcher", daemon=True)
+        self._thread.start()
+
+    def add(self, path: str):
+        with self._lock:
+            if path in self._watched:
+                return
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+            if wd < 0:
+                logger.error(f"Could not watch {path}: {os.strerror(ctypes.get_errno())}")
+                return
+            self._paths[wd] = path
+            self._watched.add(path)
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        os.close(self._fd)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size + length
+                with self._lock:
+                    if mask & _IN_Q_OVERFLOW:
+                        changed = list(self._paths.values())
+                    else:
+                        changed = [self._paths.get(wd)]
+                    if mask & _IN_IGNORED and wd in self._paths:
+                        self._watched.discard(self._paths.pop(wd))
+                for path in changed:
+                    if path is not None:
+                        self._on_change(path)
+
+
+_index: Optional[DirIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index(cache_file: str) -> DirIndex:
+    """The index is shared by the whole process, so it survives the panel being re-created."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DirIndex(cache_file)
+        return _index
@@ -0,0 +1,49 @@
+import hashlib
+import os
+from typing import NamedTuple, Optional
+
+# size of each sampled block, in bytes
+BLOCK_SIZE = 64 * 1024
+# number of blocks read from files larger than SAMPLES * BLOCK_SIZE, evenly spread from start to end
+SAMPLES = 5
+
+
+class Fingerprint(NamedTuple):
+    mtime: int
+    size: Optional[int] = None
+    inode: Optional[int] = None
+    hash: Optional[str] = None
+
+
+def sampled_hash(path: str, size: Optional[int] = None) -> str:
+    """Hash of a few blocks spread over the file plus its size. Small files are hashed completely."""
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as file:
+        if size <= SAMPLES * BLOCK_SIZE:
+            digest.update(file.read())
+        else:
+            step = (size - BLOCK_SIZE) // (SAMPLES - 1)
+            for i in range(SAMPLES):
+                file.seek(i * step)
+                digest.update(file.read(BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def fingerprint(path: str, with_hash=False) -> Fingerprint:
+    stat = os.stat(path)
+    file_hash = sampled_hash(path, stat.st_size) if with_hash else None
+    return Fingerprint(int(stat.st_mtime), stat.st_size, stat.st_ino, file_hash)
+
+
+def is_same_content(stored: Fingerprint, current: Fingerprint, mode: str, path: str) -> bool:
+    """Whether a file whose mtime differs from the stored one still has the same content.
+
+    mode is "mtime" (never) or "hash" (same size and sampled content hash, e.g. touched or copied again by rsync).
+    Size and inode alone are not enough, tools like mkvpropedit edit files in place without changing either."""
+    if mode == "mtime" or stored.size is None or stored.size != current.size:
+        return False
+    if mode == "hash":
+        return stored.hash is not None and stored.hash == sampled_hash(path, current.size)
+    return False
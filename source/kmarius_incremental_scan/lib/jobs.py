@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Optional
+
+from . import logger
+
+# number of finished jobs that are kept around for status queries
+HISTORY_SIZE = 50
+
+
+class Job:
+    """Progress and cancellation state of a long-running panel operation."""
+
+    def __init__(self, name: str, description: str = ""):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.description = description
+        self.status = "queued"
+        self.done = 0
+        self.total: Optional[int] = None
+        self.message = ""
+        # operation specific summary, available once the job finished
+        self.result: Optional[dict] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        """Whether the job is queued or running."""
+        return self.finished is None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def start(self):
+        self.status = "running"
+        self.started = time.time()
+
+    def advance(self, n: int = 1, message: str = None):
+        self.done += n
+        if message is not None:
+            self.message = message
+
+    def finish(self, status: str = None, message: str = None):
+        if status is None:
+            status = "cancelled" if self.cancelled else "finished"
+        self.status = status
+        if message is not None:
+            self.message = message
+        self.finished = time.time()
+
+    def to_dict(self) -> dict:
+        throughput = None
+        eta = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+            if elapsed > 0 and self.done > 0:
+                throughput = self.done / elapsed
+                if self.total is not None and self.finished is None:
+                    eta = max(self.total - self.done, 0) / throughput
+        return {
+            "id":          self.id,
+            "name":        self.name,
+            "description": self.description,
+            "status":      self.status,
+            "done":        self.done,
+            "total":       self.total,
+            "message":     self.message,
+            "result":      self.result,
+            "created":     self.created,
+            "started":     self.started,
+            "finished":    self.finished,
+            "throughput":  throughput,
+            "eta":         eta,
+        }
+
+
+class JobManager:
+    """Runs queued jobs in submission order on a bounded number of worker threads."""
+
+    def __init__(self, max_workers: int = 1):
+        self._max_workers = max_workers
+        self._num_workers = 0
+        self._queue = queue.Queue()
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def set_max_workers(self, max_workers: int):
+        with self._lock:
+            self._max_workers = max(max_workers, 1)
+            self._spawn_workers()
+
+    def _spawn_workers(self):
+        # called with the lock held
+        while self._num_workers < min(self._max_workers, self._queue.qsize()):
+            self._num_workers += 1
+            threading.Thread(target=self._work, name=f"kmarius-panel-job-{self._num_workers}", daemon=True).start()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if self._num_workers > self._max_workers or self._queue.empty():
+                    self._num_workers -= 1
+                    return
+                job, target = self._queue.get()
+                # cancelled while queued
+                if not job.running:
+                    continue
+                job.start()
+
+            logger.info(f"Starting job {job.name} {job.id}")
+            try:
+                target(job)
+                job.finish()
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                job.finish("failed", str(e))
+            logger.info(f"Job {job.name} {job.id} {job.status}")
+
+    def submit(self, name: str, target: Callable[[Job], None], description: str = "", unique=False) -> Job:
+        """Queue target to be called with a new job. With unique set, an active job of the same name is returned
+        instead of queueing another one."""
+        with self._lock:
+            if unique:
+                for job in self._jobs.values():
+                    if job.name == name and job.running:
+                        return job
+            job = Job(name, description)
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+            self._queue.put((job, target))
+            self._spawn_workers()
+        return job
+
+    def _forget_old_jobs(self):
+        # called with the lock held
+        finished = sorted((job for job in self._jobs.values() if not job.running), key=lambda job: job.finished)
+        for job in finished[:max(len(finished) - HISTORY_SIZE, 0)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is not None:
+            with self._lock:
+                job.cancel()
+                if job.status == "queued":
+                    job.finish("cancelled", "Cancelled before starting")
+        return job
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> JobManager:
+    """The manager is shared by the whole process, so queued jobs survive the panel being re-created."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -0,0 +1,159 @@
+import bisect
+import contextlib
+import functools
+import threading
+import time
+from typing import Iterator, Optional
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_DESCRIPTIONS = {
+    "files_checked":          "Files checked by the incremental scan file test",
+    "files_skipped":          "Files skipped because they are unchanged",
+    "files_skipped_content":  "Files skipped because their content is unchanged although their mtime changed",
+    "files_passed":           "Files passed on to the following file test plugins",
+    "timestamp_writes":       "Timestamps written to the database",
+    "timestamps_get_seconds": "Latency of reading a timestamp",
+    "timestamps_put_seconds": "Latency of writing timestamps",
+    "panel_request_seconds":  "Latency of data panel API requests",
+}
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count":   self.count,
+            "sum":     self.sum,
+            "mean":    self.sum / self.count if self.count else None,
+            "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], self.cumulative())),
+        }
+
+    def cumulative(self) -> list[int]:
+        res = []
+        total = 0
+        for count in self.counts:
+            total += count
+            res.append(total)
+        return res
+
+
+class Metrics:
+    """Counters and latency histograms of this process, kept in memory only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[LabelKey, int]] = {}
+        self._histograms: dict[str, dict[LabelKey, _Histogram]] = {}
+        self._started = time.time()
+
+    def inc(self, name: str, n: int = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + n
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms.setdefault(name, {}).get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = _Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def get(self, name: str, **labels: str) -> int:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            return self._counters.get(name, {}).get(key, 0)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "started":    self._started,
+                "counters":   {name: [{"labels": dict(key), "value": value} for key, value in values.items()]
+                               for name, values in self._counters.items()},
+                "histograms": {name: [{"labels": dict(key), **histogram.to_dict()}
+                                      for key, histogram in values.items()]
+                               for name, values in self._histograms.items()},
+            }
+
+    def to_prometheus(self, prefix: str = "kmarius_incremental_scan_") -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._counters.items()):
+                full_name = prefix + name + "_total"
+                _describe(lines, full_name, name, "counter")
+                for key, value in values.items():
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+            for name, values in sorted(self._histograms.items()):
+                full_name = prefix + name
+                _describe(lines, full_name, name, "histogram")
+                for key, histogram in values.items():
+                    for bound, count in zip([str(bound) for bound in BUCKETS] + ["+Inf"], histogram.cumulative()):
+                        lines.append(f"{full_name}_bucket{_format_labels(key, le=bound)} {count}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _describe(lines: list[str], full_name: str, name: str, metric_type: str):
+    description = _DESCRIPTIONS.get(name)
+    if description:
+        lines.append(f"# HELP {full_name} {description}")
+    lines.append(f"# TYPE {full_name} {metric_type}")
+
+
+def _format_labels(key: LabelKey, le: Optional[str] = None) -> str:
+    labels = list(key)
+    if le is not None:
+        labels.append(("le", le))
+    if len(labels) == 0:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Metrics are shared by the whole process, so they survive the plugin being reloaded."""
+    return _metrics
+
+
+def timed(name: str, **labels: str):
+    """Decorator recording the latency of every call in the histogram name."""
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with _metrics.timer(name, **labels):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
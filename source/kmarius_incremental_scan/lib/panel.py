@@ -1,35 +1,41 @@
+import bisect
+import gzip
+import hashlib
 import json
 import os
 import queue
-import re
 import threading
 import time
 import traceback
 import uuid
-from typing import Mapping, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional, Tuple
 
 from unmanic.libs.filetest import FileTesterThread
 from unmanic.libs.libraryscanner import LibraryScannerManager
-from unmanic.libs.unmodels import Libraries
+from unmanic.libs.unmodels import Libraries, Tasks
 
+from .jobs import Job
+from .pathfilter import PathFilter
 from .plugin_types import *
-from . import timestamps, logger
-
-
-def critical(f):
-    """Decorator to allow only one thread to execute this function at a time."""
-    lock = threading.Lock()
-
-    def wrapped(*args, **kwargs):
-        if not lock.acquire(blocking=False):
-            logger.info("Could not acquire lock")
-            return
-        try:
-            f(*args, **kwargs)
-        finally:
-            lock.release()
-
-    return wrapped
+from . import dirindex, fingerprint, jobs, metrics, timestamps, walk, logger
+
+PRUNE_CHUNK_SIZE = 1000
+PRUNE_WORKERS = 16
+WALK_WORKERS = 8
+TEST_QUEUE_SIZE = 1000
+# paths per query when checking for pending tasks, stays below sqlite's default limit of host parameters
+ENQUEUE_CHUNK_SIZE = 500
+# default number of files listed by /diff, the counts always cover all files
+DIFF_LIMIT = 1000
+# default number of results of /search
+SEARCH_LIMIT = 200
+# default page size of /recent
+RECENT_LIMIT = 100
+# minimum time between progress messages sent to the frontend while testing, in seconds
+PROGRESS_INTERVAL = 0.5
+# part of every etag, the versions they are made of only count within a process
+_INSTANCE = uuid.uuid4().hex
 
 
 def _get_thread(name: str) -> Optional[threading.Thread]:
@@ -50,16 +56,51 @@ def _get_library_paths() -> Mapping[int, str]:
     return paths
 
 
+def _get_export_dir() -> str:
+    return os.path.join(os.path.dirname(timestamps.DB_PATH), "exports")
+
+
 def _validate_path(path: str, library_path: str) -> bool:
     return path.startswith("/") and "/.." not in path and path.startswith(library_path)
 
 
-def _expand_path(path: str) -> list[str]:
-    res = []
-    for dirpath, _, filenames in os.walk(path):
-        for filename in filenames:
-            res.append(os.path.join(dirpath, filename))
-    return res
+# children of a folder are ordered directories first, then files, both by name. the cursor is the key of the last
+# child of the previous page, so pages stay consistent when entries are added or removed in between
+def _paginate(listing: walk.DirListing, limit: Optional[int] = None,
+              cursor: Optional[str] = None) -> Tuple[list[str], list[walk.FileInfo], Optional[str]]:
+    entries = [("d", name) for name in sorted(listing.dirs)]
+    files = sorted(listing.files, key=lambda f: f.name)
+    entries += [("f", file_info.name) for file_info in files]
+
+    start = 0
+    if cursor:
+        kind, _, name = cursor.partition(":")
+        start = bisect.bisect_right(entries, (kind, name))
+    end = len(entries) if limit is None else min(start + limit, len(entries))
+
+    num_dirs = len(listing.dirs)
+    dirs = [name for _, name in entries[start:min(end, num_dirs)]]
+    files = files[max(start - num_dirs, 0):max(end - num_dirs, 0)]
+
+    next_cursor = None
+    if end < len(entries):
+        kind, name = entries[end - 1]
+        next_cursor = f"{kind}:{name}"
+    return dirs, files, next_cursor
+
+
+def _describe_items(items_per_lib: Mapping[int, Iterable[str]]) -> str:
+    paths = [path for items in items_per_lib.values() for path in items]
+    if len(paths) == 1:
+        return paths[0]
+    return f"{len(paths)} items"
+
+
+def _job_response(job: Job) -> dict:
+    return {
+        "success": True,
+        "job":     job.to_dict(),
+    }
 
 
 # possibly make this configurable
@@ -75,22 +116,157 @@ def _get_icon(name: str) -> str:
         return "bi bi-file-earmark"
 
 
-def _test_files_in_lib(library_id: int, items: Set[str]):
-    num_files = len(items)
-    if num_files == 0:
-        return
+# nodes for files found in the database instead of a listing, e.g. by /search. the files are stat'ed for their
+# modification time on disk, which is None if they no longer exist
+def _stored_file_nodes(rows: Iterable[Tuple[int, str, int]]) -> list[dict]:
+    library_paths = _get_library_paths()
+    nodes = []
+    for library_id, path, timestamp in rows:
+        library_path = library_paths.get(library_id)
+        if library_path is None:
+            continue
+        try:
+            stat = os.stat(path)
+            mtime, size = int(stat.st_mtime), stat.st_size
+        except OSError:
+            mtime, size = None, None
+        nodes.append({
+            "title":      os.path.relpath(path, library_path),
+            "library_id": library_id,
+            "path":       path,
+            "mtime":      mtime,
+            "size":       size,
+            "icon":       _get_icon(path),
+            "timestamp":  timestamp,
+        })
+    return nodes
+
+
+# the compact format of /subtree stores each folder as {"t": title, "d": [folders], "f": files, "c": cursor} with
+# "l": 1 and "r": [files, processed, pending, bytes] for folders that are loaded lazily. files are columns
+# {"n": names, "m": mtimes, "s": sizes, "i": icons, "ts": timestamps} where icons index the "icons" list of the
+# response. paths are implied by the titles and the path of the root, the library_id is only stored at the root
+def _to_compact(subtree: dict) -> dict:
+    icons = {}
+
+    def encode(node: dict) -> dict:
+        res = {"t": node["title"]}
+        if node.get("lazy"):
+            res["l"] = 1
+            if "rollup" in node:
+                res["r"] = list(node["rollup"].values())
+            return res
+        folders = []
+        names, mtimes, sizes, icon_codes, stamps = [], [], [], [], []
+        for child in node["children"]:
+            if child.get("type") == "folder":
+                folders.append(encode(child))
+            else:
+                names.append(child["title"])
+                mtimes.append(child["mtime"])
+                sizes.append(child["size"])
+                icon_codes.append(icons.setdefault(child["icon"], len(icons)))
+                stamps.append(child.get("timestamp"))
+        if len(folders) > 0:
+            res["d"] = folders
+        if len(names) > 0:
+            res["f"] = {"n": names, "m": mtimes, "s": sizes, "i": icon_codes, "ts": stamps}
+        if "cursor" in node:
+            res["c"] = node["cursor"]
+        return res
+
+    tree = encode(subtree)
+    return {
+        "format":     "compact",
+        "library_id": subtree["library_id"],
+        "path":       subtree["path"],
+        "icons":      list(icons),
+        "tree":       tree,
+    }
+
+
+class _CallbackQueue(queue.Queue):
+    """Stands in for a queue the file testers put results into, hands each item to a callback right away."""
+
+    def __init__(self, callback: Callable[[Any], None]):
+        super().__init__()
+        self._callback = callback
+
+    def put(self, item, block=True, timeout=None):
+        self._callback(item)
+
+
+# the frontend sends selected children along with their selected parents
+def _minimize_selection(paths: Iterable[str]) -> list[str]:
+    res = []
+    for path in sorted(paths, key=lambda p: p + "/"):
+        if len(res) == 0 or not path.startswith(res[-1] + "/"):
+            res.append(path)
+    return res
+
+
+def _get_pending_paths(paths: Iterable[str]) -> set[str]:
+    """Paths that already have a task in unmanic's queue."""
+    paths = list(paths)
+    pending = set()
+    for i in range(0, len(paths), ENQUEUE_CHUNK_SIZE):
+        chunk = paths[i:i + ENQUEUE_CHUNK_SIZE]
+        for task in Tasks.select(Tasks.abspath).where(Tasks.abspath.in_(chunk)):
+            pending.add(task.abspath)
+    return pending
+
+
+def _enqueue_files(library_id: int, paths: Iterable[str], priority_score: int, job: Job,
+                   seen: Optional[set[str]] = None) -> Tuple[int, int, int]:
+    """Create tasks for all paths that are not already queued, checking the queue one chunk at a time.
 
+    Returns the number of queued files, of already pending files and of paths that were seen before."""
+    libraryscanner = _get_libraryscanner()
+    if seen is None:
+        seen = set()
+    num_queued = 0
+    num_pending = 0
+    num_duplicates = 0
+
+    def flush(chunk: list[str]):
+        nonlocal num_queued, num_pending
+        pending = _get_pending_paths(chunk)
+        for path in chunk:
+            if job.cancelled:
+                return
+            if path in pending:
+                num_pending += 1
+                job.advance(1)
+                continue
+            libraryscanner.add_path_to_queue(path, library_id, priority_score)
+            num_queued += 1
+            job.advance(1, f"Queued: {path}")
+
+    chunk = []
+    for path in paths:
+        if job.cancelled:
+            break
+        path = os.path.abspath(path)
+        if path in seen:
+            num_duplicates += 1
+            job.advance(1)
+            continue
+        seen.add(path)
+        chunk.append(path)
+        if len(chunk) >= ENQUEUE_CHUNK_SIZE:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    return num_queued, num_pending, num_duplicates
+
+
+def _test_files_in_lib(library_id: int, paths: Iterable[str], job: Job):
     libraryscanner = _get_libraryscanner()
     num_threads = libraryscanner.settings.get_concurrent_file_testers()
 
-    # pre-fill queue
-    files_to_test = queue.Queue()
-    for item in items:
-        files_to_test.put(item)
-    files_to_process = queue.Queue()
-
     event = libraryscanner.event
-    status_updates = queue.Queue()
     frontend_messages = libraryscanner.data_queues.get('frontend_messages')
 
     def send_frontend_message(message):
@@ -104,6 +280,50 @@ def _test_files_in_lib(library_id: int, items: Set[str]):
             }
         )
 
+    lock = threading.Lock()
+    progress = threading.Event()
+    num_files = None
+    num_tested = 0
+    current_file = ''
+
+    def queue_up_result(item):
+        with lock:
+            libraryscanner.add_path_to_queue(
+                item.get('path'), library_id, item.get('priority_score'))
+
+    def on_status_update(path):
+        nonlocal num_tested, current_file
+        with lock:
+            num_tested += 1
+            current_file = path
+            job.advance(1, f"Testing: {path}")
+        progress.set()
+
+    # the walker blocks while the queue is full, so we never hold more than a few paths in memory
+    files_to_test = queue.Queue(maxsize=TEST_QUEUE_SIZE)
+    files_to_process = _CallbackQueue(queue_up_result)
+    status_updates = _CallbackQueue(on_status_update)
+
+    def produce():
+        nonlocal num_files
+        count = 0
+        try:
+            for path in paths:
+                if job.cancelled:
+                    break
+                files_to_test.put(path)
+                count += 1
+        except Exception:
+            logger.error(traceback.format_exc())
+        finally:
+            num_files = count
+            if job.total is None:
+                job.total = 0
+            job.total += count
+            progress.set()
+
+    threading.Thread(target=produce, name=f"kmarius-file-walker-{library_id}", daemon=True).start()
+
     threads = []
 
     for i in range(num_threads):
@@ -114,48 +334,44 @@ def _test_files_in_lib(library_id: int, items: Set[str]):
         tester.start()
         threads.append(tester)
 
-    def queue_up_result(item):
-        libraryscanner.add_path_to_queue(
-            item.get('path'), library_id, item.get('priority_score'))
-
-    current_file = ''
-    while not files_to_test.empty():
-        while not files_to_process.empty():
-            queue_up_result(files_to_process.get())
-
-        if not status_updates.empty():
-            current_file = status_updates.get()
-            while not status_updates.empty():
-                current_file = status_updates.get()
-            percent_completed = (num_files - files_to_test.qsize()) / num_files * 100
-            percent_completed_string = '{:.0f}% - Testing: {}'.format(percent_completed, current_file)
-            send_frontend_message(percent_completed_string)
-
-        event.wait(0.1)
+    last_message = 0
+    while True:
+        progress.wait()
+        progress.clear()
+
+        if job.cancelled and num_files is not None:
+            while not files_to_test.empty():
+                try:
+                    files_to_test.get_nowait()
+                except queue.Empty:
+                    break
+
+        done = num_files is not None and files_to_test.empty()
+        now = time.monotonic()
+        if done or now - last_message >= PROGRESS_INTERVAL:
+            last_message = now
+            with lock:
+                if done:
+                    message = '{:.0f}% - Testing: {}'.format(100, current_file)
+                elif num_files:
+                    message = '{:.0f}% - Testing: {}'.format(num_tested / num_files * 100, current_file)
+                else:
+                    message = '{} files - Testing: {}'.format(num_tested, current_file)
+            send_frontend_message(message)
 
-    while not status_updates.empty():
-        current_file = status_updates.get()
-    percent_completed_string = '{:.0f}% - Testing: {}'.format(100, current_file)
-    send_frontend_message(percent_completed_string)
+        if done:
+            break
 
+    # testers finish the file they are currently testing before exiting
     for thread in threads:
         thread.stop()
 
     for thread in threads:
         thread.join()
 
-    while not files_to_process.empty():
-        queue_up_result(files_to_process.get())
-
     frontend_messages.remove_item('libraryScanProgress')
 
 
-@critical
-def _test_files_thread(items_per_lib: Mapping[int, Set[str]]):
-    for library_id, paths in items_per_lib.items():
-        _test_files_in_lib(library_id, paths)
-
-
 class Panel:
     # we pass the settings class because a library might get added and we need to instantiate the configuration for it
     def __init__(self, settings_cl):
@@ -163,79 +379,62 @@ class Panel:
         self.settings_cl = settings_cl
         # we can cache some things meaningfully. allowed extensions for example, because when they change plugin.py is
         # re-executed and the Panel is re-created
-        self._allowed_extensions = {}
-        self._ignore_patterns = {}
-
-    def _is_extension_allowed(self, library_id: int, path: str) -> bool:
-        if library_id not in self._allowed_extensions:
-            extensions = self.settings.get_setting(f"library_{library_id}_extensions").split(",")
-            extensions = [ext.strip().lstrip(".") for ext in extensions]
-            extensions = [ext for ext in extensions if ext != ""]
-            if len(extensions) == 0:
-                extensions = None
-            self._allowed_extensions[library_id] = extensions
-        extensions = self._allowed_extensions[library_id]
-        if not extensions:
-            return True
-        _, ext = os.path.splitext(path)
-        ext = ext.lstrip(".").lower()
-        return ext in extensions
-
-    def _is_path_ignored(self, library_id: int, path: str) -> bool:
-        if library_id not in self._ignore_patterns:
-            patterns = []
-            for pattern in self.settings.get_setting(f"library_{library_id}_ignored_paths").splitlines():
-                pattern = pattern.strip()
-                if pattern != "" and not pattern.startswith("#"):
-                    patterns.append(re.compile(pattern))
-            self._ignore_patterns[library_id] = patterns
-        for pattern in self._ignore_patterns[library_id]:
-            if pattern.search(path):
-                return True
-        return False
-
-    def _is_in_library(self, library_id: int, path: str) -> bool:
-        return self._is_extension_allowed(library_id, path) and not self._is_path_ignored(library_id, path)
-
-    def _test_files(self, payload: dict):
-        library_paths = _get_library_paths()
-
-        if "arr" in payload:
-            items = payload["arr"]
+        self._filters: dict[int, PathFilter] = {}
+        timestamps.ensure_init()
+        self._index = dirindex.get_index(os.path.join(os.path.dirname(timestamps.DB_PATH), "dirindex.pickle"))
+        if self.settings.get_setting("watch_libraries"):
+            self._index.start_watcher()
         else:
-            items = [payload]
-
-        items_per_lib = {}
+            self._index.stop_watcher()
+        self._jobs = jobs.get_manager()
+        self._jobs.set_max_workers(int(self.settings.get_setting("panel_job_workers")))
+        # a job that is still running may have read the setting before it changed
+        if (bool(self.settings.get_setting("search_index")) != timestamps.has_search_index()
+                or any(job.name == "search index" and job.running for job in self._jobs.list())):
+            self._jobs.submit("search index", self._sync_search_index)
+
+    # the setting can change again while a job waits or runs, so every job builds or drops the index according to the
+    # setting at the time it runs. set_search_index serializes jobs, the later ones find nothing left to do
+    def _sync_search_index(self, job: Job):
+        enabled = bool(self.settings_cl().get_setting("search_index"))
+        job.description = "build" if enabled else "drop"
+        if timestamps.set_search_index(enabled) != enabled:
+            raise Exception(f"Could not {job.description} the search index")
+
+    def _get_filter(self, library_id: int) -> PathFilter:
+        path_filter = self._filters.get(library_id)
+        if path_filter is None:
+            path_filter = PathFilter.from_settings(
+                self.settings.get_setting(f"library_{library_id}_extensions"),
+                self.settings.get_setting(f"library_{library_id}_ignored_paths"))
+            self._filters[library_id] = path_filter
+        return path_filter
 
-        for item in items:
-            library_id = item["library_id"]
-            path = item["path"]
-
-            if not _validate_path(path, library_paths[library_id]):
-                raise Exception("Invalid path")
+    def _is_in_library(self, library_id: int, path: str) -> bool:
+        return self._get_filter(library_id).matches(path)
 
-            if not library_id in items_per_lib:
-                items_per_lib[library_id] = set()
+    def _expand_path(self, path: str) -> list[str]:
+        return self._index.files(path, WALK_WORKERS)
 
+    # yields selected files and the files in selected directories that belong to the library
+    def _iter_selection(self, library_id: int, paths: Iterable[str],
+                        on_filtered: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+        path_filter = self._get_filter(library_id)
+        for path in _minimize_selection(paths):
             if os.path.isdir(path):
-                items_ = items_per_lib[library_id]
-                for path in _expand_path(path):
-                    if self._is_in_library(library_id, path):
-                        items_.add(path)
+                for file in self._index.iter_files(path):
+                    if path_filter.matches(file):
+                        yield file
+                    elif on_filtered:
+                        on_filtered(file)
             else:
-                items_per_lib[library_id].add(path)
-
-        threading.Thread(
-            target=_test_files_thread,
-            args=(items_per_lib,),
-            daemon=True
-        ).start()
+                yield path
 
-    def _process_files(self, payload: dict):
+    @staticmethod
+    def _group_items(payload: dict) -> dict[int, dict[str, int]]:
+        """Validates the selected items and groups them per library, mapping paths to their priority score."""
         library_paths = _get_library_paths()
 
-        libraryscanner = _get_libraryscanner()
-
         if "arr" in payload:
             items = payload["arr"]
         else:
@@ -246,74 +445,168 @@ class Panel:
         for item in items:
             library_id = item["library_id"]
             path = item["path"]
-            priority_score = item["priority_score"]
 
             if not _validate_path(path, library_paths[library_id]):
                 raise Exception("Invalid path")
 
             if not library_id in items_per_lib:
-                items_per_lib[library_id] = []
+                items_per_lib[library_id] = {}
+
+            items_per_lib[library_id][path] = item.get("priority_score", 0)
+
+        return items_per_lib
+
+    def _test_files(self, payload: dict) -> Job:
+        items_per_lib = self._group_items(payload)
+
+        def run(job: Job):
+            for library_id, items in items_per_lib.items():
+                if job.cancelled:
+                    break
+                # directories are expanded while testing
+                _test_files_in_lib(library_id, self._iter_selection(library_id, items.keys()), job)
+
+        return self._jobs.submit("test", run, _describe_items(items_per_lib))
+
+    def _process_files(self, payload: dict) -> Job:
+        items_per_lib = self._group_items(payload)
+
+        def run(job: Job):
+            num_queued = 0
+            num_pending = 0
+            num_duplicates = 0
+            num_filtered = 0
+
+            def on_filtered(_):
+                nonlocal num_filtered
+                num_filtered += 1
+
+            # the same file can be selected in more than one library
+            seen = set()
+            for library_id, items in items_per_lib.items():
+                for path in _minimize_selection(items.keys()):
+                    if job.cancelled:
+                        break
+                    # the walk is cheap once the index holds the listings, counting first gives the job a total
+                    count = sum(1 for _ in self._iter_selection(library_id, [path]))
+                    if job.total is None:
+                        job.total = 0
+                    job.total += count
+                    files = self._iter_selection(library_id, [path], on_filtered=on_filtered)
+                    queued, pending, duplicates = _enqueue_files(library_id, files, items[path], job, seen=seen)
+                    num_queued += queued
+                    num_pending += pending
+                    num_duplicates += duplicates
+
+            job.result = {
+                "queued":     num_queued,
+                "pending":    num_pending,
+                "duplicates": num_duplicates,
+                "filtered":   num_filtered,
+            }
+            job.message = (f"Queued {num_queued} files, {num_pending} already pending, "
+                           f"{num_duplicates} selected more than once, {num_filtered} filtered out")
 
-            if os.path.isdir(path):
-                items_ = items_per_lib[library_id]
-                for path in _expand_path(path):
-                    if self._is_in_library(library_id, path):
-                        items_.append(
-                            {"path": path, "priority_score": priority_score})
-            else:
-                items_per_lib[library_id].append(
-                    {"path": path, "priority_score": priority_score})
-
-        for library_id, items in items_per_lib.items():
-            for item in items:
-                libraryscanner.add_path_to_queue(
-                    item['path'], library_id, item['priority_score'])
+        return self._jobs.submit("process", run, _describe_items(items_per_lib))
 
     # this function can't load single files currently, only directories with their files
+    # identifies a response of /subtree by the versions of the directory listings it is built from, the writes to the
+    # timestamps of the library and everything else the response depends on
+    def _subtree_etag(self, library_id: int, listings: Mapping[str, walk.DirListing], options: list) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([
+            _INSTANCE,
+            timestamps.generation(library_id),
+            self.settings.get_setting(f"library_{library_id}_extensions"),
+            self.settings.get_setting(f"library_{library_id}_ignored_paths"),
+            *options,
+        ]).encode("utf-8"))
+        for path in sorted(listings):
+            digest.update(f"\0{path}\0{self._index.version(path)}".encode("utf-8", "surrogateescape"))
+        return digest.hexdigest()
+
     def _load_subtree(self, path: str, title: str, library_id: int, lazy=True, hide_empty=False,
-                      prune_ignored=False, timestamp_cache=None) -> dict:
-        children = []
-        files = []
+                      prune_ignored=False, timestamp_cache=None, refresh=False, limit: Optional[int] = None,
+                      cursor: Optional[str] = None, etag: Optional[str] = None, preload_timestamps=False,
+                      compact=False) -> dict:
+        path_filter = self._get_filter(library_id)
+        prune_dir = path_filter.is_ignored if prune_ignored else None
+        include_file = path_filter.matches
+
+        root = os.path.abspath(path)
+        if prune_dir and prune_dir(root):
+            listings = {}
+        elif lazy:
+            listing = self._index.listing(root, refresh=refresh)
+            listings = {root: walk.filter_listing(root, listing, prune_dir, include_file)}
+        else:
+            listings = self._index.walk(root, WALK_WORKERS, prune_dir, include_file, refresh=refresh)
+
+        # an unchanged subtree is neither built nor sent again, the frontend keeps its own copy
+        new_etag = self._subtree_etag(library_id, listings, [path, title, lazy, hide_empty, prune_ignored, limit,
+                                                             cursor, compact])
+        if etag == new_etag:
+            return {
+                "success":      True,
+                "not_modified": True,
+                "etag":         etag,
+                "path":         path,
+            }
 
-        if not (prune_ignored and self._is_path_ignored(library_id, path)):
-            with os.scandir(path) as entries:
-                for entry in entries:
-                    name = entry.name
-                    if name.startswith("."):
-                        continue
-
-                    abspath = os.path.abspath(os.path.join(path, name))
-
-                    if not (prune_ignored and self._is_path_ignored(library_id, abspath)):
-                        if entry.is_dir():
-                            if lazy:
-                                children.append({
-                                    "title":      name,
-                                    "library_id": library_id,
-                                    "path":       abspath,
-                                    "lazy":       True,
-                                    "type":       "folder",
-                                })
-                            else:
-                                child = self._load_subtree(abspath, name, library_id,
-                                                           lazy=False, hide_empty=hide_empty,
-                                                           prune_ignored=prune_ignored, timestamp_cache=timestamp_cache)
-                                if not (hide_empty and len(child["children"]) == 0):
-                                    children.append(child)
-                        else:
-                            if self._is_in_library(library_id, abspath):
-                                file_info = os.stat(abspath)
-                                files.append({
-                                    "title":      name,
-                                    "library_id": library_id,
-                                    "path":       abspath,
-                                    "mtime":      int(file_info.st_mtime),
-                                    "size":       int(file_info.st_size),
-                                    "icon":       _get_icon(name),
-                                })
-
-            children.sort(key=lambda c: c["title"])
-            files.sort(key=lambda c: c["title"])
+        if preload_timestamps and timestamp_cache is None:
+            timestamp_cache = timestamps.get_all(library_id)
+
+        subtree = self._build_subtree(root, title, library_id, listings, lazy=lazy, hide_empty=hide_empty,
+                                      timestamp_cache=timestamp_cache, limit=limit, cursor=cursor)
+        subtree["path"] = path
+        if compact:
+            subtree = _to_compact(subtree)
+        subtree["etag"] = new_etag
+        return subtree
+
+    # with a limit, every folder contains at most limit children and a cursor to fetch the next page
+    def _build_subtree(self, path: str, title: str, library_id: int, listings: Mapping[str, walk.DirListing],
+                       lazy=True, hide_empty=False, timestamp_cache=None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> dict:
+        children = []
+        next_cursor = None
+
+        listing = listings.get(path)
+        if listing is not None:
+            dirs, file_infos, next_cursor = _paginate(listing, limit, cursor)
+            for name in dirs:
+                abspath = os.path.join(path, name)
+                if lazy:
+                    children.append({
+                        "title":      name,
+                        "library_id": library_id,
+                        "path":       abspath,
+                        "lazy":       True,
+                        "type":       "folder",
+                    })
+                else:
+                    child = self._build_subtree(abspath, name, library_id, listings,
+                                                lazy=False, hide_empty=hide_empty,
+                                                timestamp_cache=timestamp_cache, limit=limit)
+                    if not (hide_empty and len(child["children"]) == 0 and "cursor" not in child):
+                        children.append(child)
+
+            # lazy folders show what is stored below them without being walked
+            if lazy and len(children) > 0:
+                rollups = timestamps.get_rollups(library_id, [child["path"] for child in children])
+                for child, rollup in zip(children, rollups):
+                    child["rollup"] = rollup._asdict()
+
+            files = []
+            for file_info in file_infos:
+                files.append({
+                    "title":      file_info.name,
+                    "library_id": library_id,
+                    "path":       os.path.join(path, file_info.name),
+                    "mtime":      file_info.mtime,
+                    "size":       file_info.size,
+                    "icon":       _get_icon(file_info.name),
+                })
 
             if len(files) > 0:
                 if timestamp_cache:
@@ -326,18 +619,26 @@ class Panel:
 
             children += files
 
-        return {
+        subtree = {
             "title":      title,
             "children":   children,
             "library_id": library_id,
             "path":       path,
             "type":       "folder",
         }
+        if next_cursor is not None:
+            subtree["cursor"] = next_cursor
+        return subtree
 
     def _get_subtree(self, arguments: dict) -> dict:
         library_id = int(arguments["library_id"][0])
         path = arguments["path"][0].decode('utf-8')
         title = arguments["title"][0].decode('utf-8')
+        refresh = "refresh" in arguments
+        limit = int(arguments["limit"][0]) if "limit" in arguments else None
+        cursor = arguments["cursor"][0].decode('utf-8') if "cursor" in arguments else None
+        etag = arguments["etag"][0].decode('utf-8') if "etag" in arguments else None
+        compact = "format" in arguments and arguments["format"][0] == b"compact"
 
         library = Libraries().select().where(Libraries.id == library_id).first()
 
@@ -351,34 +652,200 @@ class Panel:
         hide_empty = self.settings.get_setting(f"library_{library_id}_hide_empty")
         prune_ignored = self.settings.get_setting(f"library_{library_id}_prune_ignored")
 
-        # if we are loading an entire library it is much faster to create a hashmap of all files and timestamps
-        timestamp_cache = None
-        if not lazy and path == library.path:
-            timestamp_cache = timestamps.get_all(library_id)
+        # if we are loading an entire library it is much faster to create a hashmap of all files and timestamps. with a
+        # limit only the folders are paged, the rest of the library is still loaded
+        preload_timestamps = not lazy and path == library.path
 
         return self._load_subtree(path, title, library_id, lazy=lazy, hide_empty=hide_empty,
-                                  prune_ignored=prune_ignored, timestamp_cache=timestamp_cache)
+                                  prune_ignored=prune_ignored, refresh=refresh, limit=limit, cursor=cursor,
+                                  etag=etag, preload_timestamps=preload_timestamps, compact=compact)
 
-    def _reset_timestamps(self, payload: dict):
-        if "arr" in payload:
-            items = [(item["library_id"], item["path"]) for item in payload["arr"]]
-        else:
-            items = [(payload["library_id"], payload["path"])]
+    # merges a sorted walk of the directory with the stored timestamps below it, neither side is loaded as a whole
+    def _diff(self, arguments: dict) -> dict:
+        library_id = int(arguments["library_id"][0])
+        library_paths = _get_library_paths()
+        path = arguments["path"][0].decode('utf-8') if "path" in arguments else library_paths[library_id]
+        limit = int(arguments["limit"][0]) if "limit" in arguments else DIFF_LIMIT
+        queue = "queue" in arguments
 
-        distinct = set()
-        for library_id, path in items:
-            if os.path.isdir(path):
-                for p in _expand_path(path):
-                    distinct.add((library_id, p))
+        if not _validate_path(path, library_paths[library_id]):
+            raise Exception("Invalid path")
+
+        path_filter = self._get_filter(library_id)
+        prune_ignored = self.settings.get_setting(f"library_{library_id}_prune_ignored")
+        prune_dir = path_filter.is_ignored if prune_ignored else None
+
+        root = os.path.abspath(path)
+        # files modified in place don't change the mtime of their directory, so every listing is rescanned. this also
+        # refreshes the cached listings of the tree
+        on_disk = walk.walk_sorted(root, lambda p: self._index.listing(p, refresh=True), prune_dir,
+                                   path_filter.matches)
+        stored = timestamps.iter_entries(library_id, prefix=root)
+
+        counts = {
+            "changed":   {"count": 0, "size": 0},
+            "new":       {"count": 0, "size": 0},
+            "unchanged": {"count": 0, "size": 0},
+            "orphaned":  {"count": 0},
+        }
+        # all changed paths are only kept to queue them, otherwise the first limit files are enough
+        changed = []
+        files = []
+
+        file = next(on_disk, None)
+        row = next(stored, None)
+        while file is not None or row is not None:
+            if row is None or (file is not None and file[0] < row[0]):
+                file_path, file_info = file
+                timestamp = None
+                file = next(on_disk, None)
+            elif file is None or row[0] < file[0]:
+                if path_filter.matches(row[0]):
+                    counts["orphaned"]["count"] += 1
+                row = next(stored, None)
+                continue
             else:
-                distinct.add((library_id, path))
-        values = [(library_id, path, 0) for library_id, path in distinct if
-                  self._is_in_library(library_id, path)]
+                file_path, file_info = file
+                timestamp = row[1]
+                file = next(on_disk, None)
+                row = next(stored, None)
+
+            if timestamp is None:
+                status = "new"
+            elif timestamp != file_info.mtime:
+                status = "changed"
+            else:
+                status = "unchanged"
+            counts[status]["count"] += 1
+            counts[status]["size"] += file_info.size
+            if status != "unchanged":
+                if queue:
+                    changed.append(file_path)
+                if len(files) < limit:
+                    files.append({
+                        "path":      file_path,
+                        "status":    status,
+                        "mtime":     file_info.mtime,
+                        "timestamp": timestamp,
+                        "size":      file_info.size,
+                    })
+
+        res = {
+            "library_id": library_id,
+            "path":       path,
+            **counts,
+            "files":      files,
+            "truncated":  counts["changed"]["count"] + counts["new"]["count"] > len(files),
+        }
 
-        timestamps.put_many(values)
-        logger.info(f"Reset {len(values)} timestamps")
+        if queue and len(changed) > 0:
+            def run(job: Job):
+                job.total = len(changed)
+                num_queued, num_pending, _ = _enqueue_files(library_id, changed, 0, job)
+                job.result = {
+                    "queued":  num_queued,
+                    "pending": num_pending,
+                }
+                job.message = f"Queued {num_queued} files, {num_pending} already pending"
 
-    def _update_timestamps(self, payload: dict):
+            res["job"] = self._jobs.submit("process", run, f"changed files in {path}").to_dict()
+
+        return res
+
+    # works on the stored rows only, a selected directory is a range of the directories table
+    def _reset_timestamps(self, payload: dict, job: Job):
+        items_per_lib = self._group_items(payload)
+        job.total = sum(len(items) for items in items_per_lib.values())
+
+        num_reset = 0
+        for library_id, items in items_per_lib.items():
+            paths = _minimize_selection(items.keys())
+            num_reset += timestamps.reset_prefixes(library_id, paths)
+            job.advance(len(items), f"Reset {num_reset} timestamps")
+        logger.info(f"Reset {num_reset} timestamps")
+
+    def _forget_timestamps(self, payload: dict, job: Job):
+        items_per_lib = self._group_items(payload)
+        job.total = sum(len(items) for items in items_per_lib.values())
+
+        num_removed = 0
+        for library_id, items in items_per_lib.items():
+            paths = _minimize_selection(items.keys())
+            num_removed += timestamps.remove_prefixes(library_id, paths)
+            job.advance(len(items), f"Removed {num_removed} timestamps")
+        logger.info(f"Removed {num_removed} timestamps")
+
+    def _search(self, arguments: dict) -> dict:
+        query = arguments["q"][0].decode('utf-8')
+        library_id = int(arguments["library_id"][0]) if "library_id" in arguments else None
+        limit = int(arguments["limit"][0]) if "limit" in arguments else SEARCH_LIMIT
+
+        rows = timestamps.search(query, library_id, limit + 1)
+        return {
+            "success":   True,
+            "query":     query,
+            "results":   _stored_file_nodes(rows[:limit]),
+            "truncated": len(rows) > limit,
+        }
+
+    def _recent(self, arguments: dict) -> dict:
+        library_id = int(arguments["library_id"][0]) if "library_id" in arguments else None
+        limit = int(arguments["limit"][0]) if "limit" in arguments else RECENT_LIMIT
+        cursor = arguments["cursor"][0].decode('utf-8') if "cursor" in arguments else None
+        since = int(arguments["since"][0]) if "since" in arguments else 0
+
+        rows, next_cursor = timestamps.recent(library_id, limit, cursor, since)
+        res = {
+            "success": True,
+            "results": _stored_file_nodes(rows),
+        }
+        if next_cursor is not None:
+            res["cursor"] = next_cursor
+        return res
+
+    def _rewrite_timestamps(self, payload: dict) -> dict:
+        library_id = int(payload["library_id"])
+        # old is where the library used to be, so it is usually outside of the library's current path
+        if not _validate_path(payload["old"], "/"):
+            raise Exception("Invalid path")
+        num_moved = timestamps.rewrite_prefix(library_id, payload["old"], payload["new"],
+                                              within=_get_library_paths()[library_id])
+        logger.info(f"Moved {num_moved} directories of library {library_id} from {payload['old']} to {payload['new']}")
+        return {
+            "success":     True,
+            "directories": num_moved,
+        }
+
+    # exports are written next to the database, the files can be large and only need to be read back on the server
+    def _export_timestamps(self, payload: dict, job: Job):
+        library_id = int(payload["library_id"])
+        root = payload.get("path") or _get_library_paths()[library_id]
+        export_dir = _get_export_dir()
+        os.makedirs(export_dir, exist_ok=True)
+        file = os.path.join(export_dir, f"library_{library_id}_{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+
+        with gzip.open(file, "wt", encoding="utf-8") as f:
+            num_exported = timestamps.export_entries(library_id, f, root)
+        job.result = {"file": file, "entries": num_exported}
+        job.message = f"Exported {num_exported} timestamps to {file}"
+        logger.info(f"Exported {num_exported} timestamps of library {library_id} to {file}")
+
+    # only files in the export directory are read, either by name or by full path
+    def _import_timestamps(self, payload: dict, job: Job):
+        library_id = int(payload["library_id"])
+        export_dir = os.path.realpath(_get_export_dir())
+        file = os.path.realpath(os.path.join(export_dir, payload["file"]))
+        if not file.startswith(export_dir + os.sep):
+            raise Exception(f"Exports can only be imported from {export_dir}")
+        opener = gzip.open if file.endswith(".gz") else open
+        with opener(file, "rt", encoding="utf-8") as f:
+            num_imported = timestamps.import_entries(library_id, f, payload.get("root"),
+                                                     within=_get_library_paths()[library_id])
+        job.result = {"entries": num_imported}
+        job.message = f"Imported {num_imported} timestamps"
+        logger.info(f"Imported {num_imported} timestamps into library {library_id} from {file}")
+
+    def _update_timestamps(self, payload: dict, job: Job):
         if "arr" in payload:
             items = [(item["library_id"], item["path"]) for item in payload["arr"]]
         else:
@@ -387,49 +854,103 @@ class Panel:
         distinct = set()
         for library_id, path in items:
             if os.path.isdir(path):
-                for p in _expand_path(path):
+                for p in self._expand_path(path):
                     distinct.add((library_id, p))
             else:
                 distinct.add((library_id, path))
         items = [(library_id, path) for library_id,
         path in distinct if self._is_in_library(library_id, path)]
+        job.total = len(items)
 
+        with_hash = self.settings.get_setting("change_detection") == "hash"
         values = []
         for library_id, path in items:
+            if job.cancelled:
+                return
             try:
-                mtime = int(os.path.getmtime(path))
-                values.append((library_id, path, mtime))
+                values.append((library_id, path, fingerprint.fingerprint(path, with_hash=with_hash)))
             except OSError as e:
                 logger.error(f"{e}")
+            job.advance()
 
         timestamps.put_many(values)
+        job.message = f"Updated {len(values)} timestamps"
         logger.info(f"Updated {len(values)} timestamps")
 
-    @critical
-    def _prune_database(self, payload: dict):
+    def _prune_database(self, payload: dict, job: Job):
         self._assert_libraries_configured()
 
-        library_ids = []
-
+        library_paths = _get_library_paths()
         if "library_id" in payload:
-            library_ids.append(payload["library_id"])
+            library_ids = [payload["library_id"]]
         else:
-            for lib in Libraries().select().where(Libraries.enable_remote_only == False):
-                library_ids.append(lib.id)
+            library_ids = list(library_paths.keys())
+
+        mode = payload.get("mode", self.settings.get_setting("prune_mode"))
+
+        job.total = sum(timestamps.count(library_id) for library_id in library_ids)
 
         num_pruned = 0
-        for library_id in library_ids:
-            logger.info(f"Pruning library {library_id}")
+        with ThreadPoolExecutor(max_workers=PRUNE_WORKERS) as pool:
+            for library_id in library_ids:
+                if job.cancelled:
+                    break
+                logger.info(f"Pruning library {library_id}")
+                path_filter = self._get_filter(library_id)
+
+                if mode == "walk":
+                    job.message = f"Walking library {library_id}"
+                    existing = set(self._index.files(library_paths[library_id], WALK_WORKERS,
+                                                     cancelled=lambda: job.cancelled))
+                    exists = existing.__contains__
+                else:
+                    exists = os.path.exists
+
+                for paths in timestamps.iter_paths(library_id, PRUNE_CHUNK_SIZE):
+                    if job.cancelled:
+                        break
+
+                    orphans = []
+                    candidates = []
+                    for path in paths:
+                        if path_filter.matches(path):
+                            candidates.append(path)
+                        else:
+                            orphans.append(path)
+                    if mode == "walk":
+                        results = map(exists, candidates)
+                    else:
+                        results = pool.map(exists, candidates)
+                    orphans += [path for path, found in zip(candidates, results) if not found]
 
-            paths = []
-            for path in timestamps.get_all_paths(library_id):
-                if not self._is_in_library(library_id, path) or not os.path.exists(path):
-                    paths.append(path)
+                    # one transaction per chunk
+                    timestamps.remove_paths(library_id, orphans)
 
-            timestamps.remove_paths(library_id, paths)
+                    num_pruned += len(orphans)
+                    job.advance(len(paths), f"Pruned {num_pruned} orphans")
 
-            num_pruned += len(paths)
-        logger.info(f"Pruned {num_pruned} orphans")
+        if job.cancelled:
+            logger.info(f"Pruning cancelled after removing {num_pruned} orphans")
+        else:
+            logger.info(f"Pruned {num_pruned} orphans")
+
+    def _get_jobs(self) -> dict:
+        return {
+            "success": True,
+            "jobs":    [job.to_dict() for job in self._jobs.list()],
+        }
+
+    def _get_job(self, arguments: dict) -> dict:
+        job = self._jobs.get(arguments["id"][0].decode('utf-8'))
+        if job is None:
+            raise Exception("Unknown job")
+        return _job_response(job)
+
+    def _cancel_job(self, payload: dict) -> dict:
+        job = self._jobs.cancel(payload["id"])
+        if job is None:
+            raise Exception("Unknown job")
+        return _job_response(job)
 
     def _get_libraries(self, lazy=True) -> dict:
         self._assert_libraries_configured()
@@ -455,6 +976,7 @@ class Panel:
             if not lib.id in self.settings.configured_for:
                 logger.info("recreating config")
                 self.settings = self.settings_cl()
+                self._filters = {}
                 return
 
     @staticmethod
@@ -470,33 +992,76 @@ class Panel:
         data['content_type'] = 'application/json'
 
         path = data["path"]
+        t0 = time.perf_counter()
+        known_path = True
 
         try:
             if path == "/test":
-                self._test_files(json.loads(data["body"].decode('utf-8')))
+                job = self._test_files(json.loads(data["body"].decode('utf-8')))
+                data["content"] = _job_response(job)
             elif path == '/process':
-                self._process_files(json.loads(data["body"].decode('utf-8')))
+                job = self._process_files(json.loads(data["body"].decode('utf-8')))
+                data["content"] = _job_response(job)
             elif path == '/subtree':
-                t0 = time.time()
                 data["content"] = self._get_subtree(data["arguments"])
-                t1 = time.time()
-                logger.info(f"Processing subtree took {(t1 - t0) * 1000:.2f} ms")
+                logger.info(f"Processing subtree took {(time.perf_counter() - t0) * 1000:.2f} ms")
+            elif path == "/search":
+                data["content"] = self._search(data["arguments"])
+            elif path == "/recent":
+                data["content"] = self._recent(data["arguments"])
             elif path == "/libraries":
                 data["content"] = self._get_libraries()
             elif path == "/timestamp/reset":
-                self._reset_timestamps(json.loads(data["body"].decode('utf-8')))
+                payload = json.loads(data["body"].decode('utf-8'))
+                job = self._jobs.submit("reset", lambda job: self._reset_timestamps(payload, job))
+                data["content"] = _job_response(job)
+            elif path == "/timestamp/forget":
+                payload = json.loads(data["body"].decode('utf-8'))
+                job = self._jobs.submit("forget", lambda job: self._forget_timestamps(payload, job))
+                data["content"] = _job_response(job)
+            elif path == "/timestamp/rewrite":
+                data["content"] = self._rewrite_timestamps(json.loads(data["body"].decode('utf-8')))
+            elif path == "/timestamp/export":
+                payload = json.loads(data["body"].decode('utf-8'))
+                job = self._jobs.submit("export", lambda job: self._export_timestamps(payload, job))
+                data["content"] = _job_response(job)
+            elif path == "/timestamp/import":
+                payload = json.loads(data["body"].decode('utf-8'))
+                job = self._jobs.submit("import", lambda job: self._import_timestamps(payload, job))
+                data["content"] = _job_response(job)
             elif path == "/timestamp/update":
-                self._update_timestamps(json.loads(data["body"].decode('utf-8')))
+                payload = json.loads(data["body"].decode('utf-8'))
+                job = self._jobs.submit("update", lambda job: self._update_timestamps(payload, job))
+                data["content"] = _job_response(job)
             elif path == "/prune":
                 body = data["body"].decode('utf-8')
                 if body.startswith("{"):
                     payload = json.loads(body)
                 else:
                     payload = {}
-                threading.Thread(target=self._prune_database,
-                                 args=(payload,),
-                                 daemon=True).start()
+                # there is no point in queueing a second prune
+                job = self._jobs.submit("prune", lambda job: self._prune_database(payload, job), unique=True)
+                data["content"] = _job_response(job)
+            elif path == "/diff":
+                data["content"] = self._diff(data["arguments"])
+                logger.info(f"Computing diff took {(time.perf_counter() - t0) * 1000:.2f} ms")
+            elif path == "/jobs":
+                data["content"] = self._get_jobs()
+            elif path == "/jobs/status":
+                data["content"] = self._get_job(data["arguments"])
+            elif path == "/jobs/cancel":
+                data["content"] = self._cancel_job(json.loads(data["body"].decode('utf-8')))
+            elif path == "/metrics":
+                if "format" in data["arguments"] and data["arguments"]["format"][0] == b"prometheus":
+                    data["content_type"] = "text/plain; version=0.0.4"
+                    data["content"] = metrics.get_metrics().to_prometheus()
+                else:
+                    data["content"] = {
+                        "success": True,
+                        "metrics": metrics.get_metrics().to_dict(),
+                    }
             else:
+                known_path = False
                 data["content"] = {
                     "success": False,
                     "error":   f"unknown path: {data['path']}",
@@ -508,4 +1073,8 @@ class Panel:
                 "success": False,
                 "error":   str(e),
                 "trace":   trace,
-            }
\ No newline at end of file
+            }
+
+        # unknown paths are not recorded, every one of them would become a separate series
+        if known_path:
+            metrics.get_metrics().observe("panel_request_seconds", time.perf_counter() - t0, endpoint=path)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import functools
+import re
+from typing import Iterable, Optional
+
+# patterns referring to groups by number or name can't be merged into a single alternation
+_GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?P<|\(\?\(")
+# global inline flags are only allowed at the start of an expression, so we turn them into scoped flags
+_GLOBAL_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+
+
+def _scope_flags(pattern: str) -> str:
+    match = _GLOBAL_FLAGS.match(pattern)
+    if match:
+        return f"(?{match.group(1)}:{pattern[match.end():]})"
+    return f"(?:{pattern})"
+
+
+class PathFilter:
+    """Allowed extensions and ignore patterns of a library, compiled into a single check."""
+
+    def __init__(self, extensions: Optional[Iterable[str]] = None, patterns: Iterable[str] = ()):
+        extensions = frozenset(ext.lower() for ext in extensions) if extensions else frozenset()
+        self.extensions = extensions if len(extensions) > 0 else None
+
+        patterns = list(patterns)
+        self._ignore = None
+        self._ignore_list = []
+        if len(patterns) == 1:
+            self._ignore = re.compile(patterns[0])
+        elif len(patterns) > 1:
+            if any(_GROUP_REFERENCE.search(pattern) for pattern in patterns):
+                self._ignore_list = [re.compile(pattern) for pattern in patterns]
+            else:
+                try:
+                    self._ignore = re.compile("|".join(_scope_flags(pattern) for pattern in patterns))
+                except re.error:
+                    self._ignore_list = [re.compile(pattern) for pattern in patterns]
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def from_settings(extensions: str, ignored_paths: str) -> "PathFilter":
+        """Build a filter from the plugin settings, compiled filters are shared between equal settings."""
+        exts = [ext.strip().lstrip(".") for ext in extensions.split(",")]
+        patterns = []
+        for pattern in ignored_paths.splitlines():
+            pattern = pattern.strip()
+            if pattern != "" and not pattern.startswith("#"):
+                patterns.append(pattern)
+        return PathFilter([ext for ext in exts if ext != ""], patterns)
+
+    def is_extension_allowed(self, path: str) -> bool:
+        if self.extensions is None:
+            return True
+        # same result as os.path.splitext, but this is called for every file
+        slash = path.rfind("/")
+        dot = path.rfind(".")
+        if dot <= slash + 1 or path[slash + 1:dot].strip(".") == "":
+            return False
+        return path[dot + 1:].lower() in self.extensions
+
+    def is_ignored(self, path: str) -> bool:
+        if self._ignore is not None:
+            return self._ignore.search(path) is not None
+        for pattern in self._ignore_list:
+            if pattern.search(path):
+                return True
+        return False
+
+    def matches(self, path: str) -> bool:
+        """Whether the path has an allowed extension and is not ignored."""
+        return self.is_extension_allowed(path) and not self.is_ignored(path)
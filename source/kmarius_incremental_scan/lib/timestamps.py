@@ -1,17 +1,20 @@
+import json
 import sqlite3
 import os
-from threading import local
-from typing import Mapping, Tuple
+from threading import local, Lock, Timer
+from typing import Iterator, Mapping, NamedTuple, Optional, TextIO, Tuple
 
 from unmanic.libs import common
 from . import logger, PLUGIN_ID
+from .fingerprint import Fingerprint
+from .metrics import get_metrics, timed
 
 
 DB_PATH = os.path.join(common.get_home_dir(), ".unmanic",
                        "userdata", PLUGIN_ID, "timestamps.db")
 
-if not os.path.exists(os.path.dirname(DB_PATH)):
-    os.makedirs(os.path.dirname(DB_PATH))
+_init_lock = Lock()
+_initialized = False
 
 
 def check_column_exists(conn: sqlite3.Connection, table_name: str, column_name: str):
@@ -22,9 +25,79 @@ def check_column_exists(conn: sqlite3.Connection, table_name: str, column_name:
     return any(column[1] == column_name for column in columns)
 
 
-# check the database table, create it if it doesn't exist.
-# migration for the addition of a column consists of dropping the table
+SCHEMA_VERSION = 5
+
+# a rollup counts the files stored for one directory: all of them, those with a timestamp (processed), those without
+# one yet, e.g. after a reset (pending) and their total size. rows without a timestamp (mtime NULL) only hold payloads
+# of the catalog and are not counted. the triggers keep the rollups up to date with every write to files, however it
+# happens, and the rollup of a directory goes with it
+_ROLLUP_DELTA = '''
+                INSERT INTO rollups (dir_id, files, processed, pending, bytes)
+                VALUES ({row}.dir_id, {sign}({row}.mtime IS NOT NULL), {sign}ifnull({row}.mtime != 0, 0),
+                        {sign}ifnull({row}.mtime = 0, 0),
+                        {sign}(CASE WHEN {row}.mtime IS NULL THEN 0 ELSE coalesce({row}.size, 0) END))
+                ON CONFLICT(dir_id) DO UPDATE SET files     = files + excluded.files,
+                                                  processed = processed + excluded.processed,
+                                                  pending   = pending + excluded.pending,
+                                                  bytes     = bytes + excluded.bytes;
+                '''
+
+_ROLLUP_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS rollups_insert AFTER INSERT ON files BEGIN "
+    f"{_ROLLUP_DELTA.format(row='NEW', sign='')} END",
+    f"CREATE TRIGGER IF NOT EXISTS rollups_update AFTER UPDATE OF mtime, size ON files BEGIN "
+    f"{_ROLLUP_DELTA.format(row='OLD', sign='-')} {_ROLLUP_DELTA.format(row='NEW', sign='')} END",
+    f"CREATE TRIGGER IF NOT EXISTS rollups_delete AFTER DELETE ON files BEGIN "
+    f"{_ROLLUP_DELTA.format(row='OLD', sign='-')} END",
+    "CREATE TRIGGER IF NOT EXISTS rollups_directories_delete AFTER DELETE ON directories BEGIN "
+    "DELETE FROM rollups WHERE dir_id = OLD.id; END",
+]
+
+# the optional search index holds the full paths of stored files in a trigram index, so paths can be searched for
+# any substring. fts5 tables only have integer keys, search_rows assigns one to every file. without the index, or
+# without fts5 and its trigram tokenizer (sqlite < 3.34), search falls back to scanning all paths
+_SEARCH_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS search_insert AFTER INSERT ON files BEGIN
+        INSERT INTO search_rows (dir_id, name) VALUES (NEW.dir_id, NEW.name);
+        INSERT INTO search (rowid, path)
+        SELECT s.id, CASE d.path WHEN '/' THEN '/' || s.name ELSE d.path || '/' || s.name END
+        FROM search_rows s
+                 JOIN directories d ON d.id = s.dir_id
+        WHERE s.dir_id = NEW.dir_id
+          AND s.name = NEW.name;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS search_delete AFTER DELETE ON files BEGIN
+        DELETE FROM search WHERE rowid = (SELECT id FROM search_rows WHERE dir_id = OLD.dir_id AND name = OLD.name);
+        DELETE FROM search_rows WHERE dir_id = OLD.dir_id AND name = OLD.name;
+    END""",
+    # only rewrite_prefix moves directories, it never moves the root
+    """
+    CREATE TRIGGER IF NOT EXISTS search_directories_update AFTER UPDATE OF path ON directories BEGIN
+        UPDATE search
+        SET path = NEW.path || substr(path, length(OLD.path) + 1)
+        WHERE rowid IN (SELECT id FROM search_rows WHERE dir_id = NEW.id);
+    END""",
+]
+
+_search_available = False
+_search_lock = Lock()
+
+# the triggers keep the rollups exact, reconciling only guards against them drifting, e.g. after the database was
+# edited by hand
+RECONCILE_INTERVAL = 24 * 60 * 60
+
+
+# check the database tables, create them if they don't exist.
+# version 0 is the flat timestamps table storing the full path of every file. version 1 stores each directory once
+# and files by their name in that directory. version 2 adds size, inode and hash of files. version 3 adds rollups,
+# version 4 an index on the timestamps. version 5 allows files without a timestamp, which only hold catalog payloads
 def init():
+    global _initialized
+    if not os.path.exists(os.path.dirname(DB_PATH)):
+        os.makedirs(os.path.dirname(DB_PATH))
+
     # attempt to migrate old database from the sibling plugin
     # remove this a year after discontinuing the other plugin
     if not os.path.exists(DB_PATH):
@@ -35,30 +108,160 @@ def init():
             os.rename(old_db, DB_PATH)
 
     conn = sqlite3.connect(DB_PATH)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    migrated = False
     with conn:
         cursor = conn.cursor()
-        if not check_column_exists(conn, "timestamps", "library_id"):
-            logger.info(
-                "Table 'timestamps' does not exists or is missing the 'library_id' column. (Re-)creating...")
-            cursor.execute("DROP TABLE IF EXISTS timestamps")
         cursor.execute('''
-                       CREATE TABLE IF NOT EXISTS timestamps
+                       CREATE TABLE IF NOT EXISTS directories
                        (
-                           library_id INTEGER NULL,
+                           id         INTEGER PRIMARY KEY,
+                           library_id INTEGER NOT NULL,
                            path       TEXT    NOT NULL,
-                           mtime      INTEGER NOT NULL,
-                           PRIMARY KEY (library_id, path)
+                           UNIQUE (library_id, path)
+                       )''')
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS files
+                       (
+                           dir_id INTEGER NOT NULL REFERENCES directories (id),
+                           name   TEXT    NOT NULL,
+                           mtime  INTEGER NULL,
+                           size   INTEGER NULL,
+                           inode  INTEGER NULL,
+                           hash   TEXT    NULL,
+                           PRIMARY KEY (dir_id, name)
+                       ) WITHOUT ROWID''')
+        for column, column_type in [("size", "INTEGER"), ("inode", "INTEGER"), ("hash", "TEXT")]:
+            if not check_column_exists(conn, "files", column):
+                cursor.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type} NULL")
+        if version < 5 and _is_mtime_required(cursor):
+            _make_mtime_nullable(cursor)
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS rollups
+                       (
+                           dir_id    INTEGER PRIMARY KEY,
+                           files     INTEGER NOT NULL,
+                           processed INTEGER NOT NULL,
+                           pending   INTEGER NOT NULL,
+                           bytes     INTEGER NOT NULL
                        )''')
+        for trigger in _ROLLUP_TRIGGERS:
+            cursor.execute(trigger)
+        # the index contains the primary key of files, so it orders entries by timestamp, directory and name
+        cursor.execute("CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime)")
+        if version < 1:
+            if check_column_exists(conn, "timestamps", "library_id"):
+                _migrate_flat_table(conn)
+                migrated = True
+            cursor.execute("DROP TABLE IF EXISTS timestamps")
+        if version < 5:
+            _reconcile_rollups(cursor)
+        if version < SCHEMA_VERSION:
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    if migrated:
+        # give the space of the flat table back
+        conn.execute("VACUUM")
+    global _search_available
+    _search_available = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'search'").fetchone() is not None
     conn.close()
+    _initialized = True
+
+
+def _is_mtime_required(cur: sqlite3.Cursor) -> bool:
+    return any(column[1] == "mtime" and column[3] for column in cur.execute("PRAGMA table_info(files)"))
+
+
+# sqlite can't drop a NOT NULL constraint, so files is copied into a new table. dropping it drops its triggers and
+# indexes, they are created again from their stored definitions, except the rollup triggers which changed. rows with
+# mtime 0 and a payload were created by the catalog, or were reset and hold metadata. both are tested again by the
+# next scan, they are turned into rows without a timestamp
+def _make_mtime_nullable(cur: sqlite3.Cursor):
+    definitions = [sql for name, sql in cur.execute("SELECT name, sql FROM sqlite_master "
+                                                    "WHERE tbl_name = 'files' AND type IN ('trigger', 'index') "
+                                                    "AND sql IS NOT NULL").fetchall()
+                   if not name.startswith("rollups_")]
+    cur.execute('''
+                CREATE TABLE files_nullable
+                (
+                    dir_id INTEGER NOT NULL REFERENCES directories (id),
+                    name   TEXT    NOT NULL,
+                    mtime  INTEGER NULL,
+                    size   INTEGER NULL,
+                    inode  INTEGER NULL,
+                    hash   TEXT    NULL,
+                    PRIMARY KEY (dir_id, name)
+                ) WITHOUT ROWID''')
+    cur.execute("INSERT INTO files_nullable SELECT dir_id, name, mtime, size, inode, hash FROM files")
+    cur.execute("DROP TABLE files")
+    cur.execute("ALTER TABLE files_nullable RENAME TO files")
+    for sql in definitions:
+        cur.execute(sql)
+    payload_tables = [row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                                    "AND name LIKE 'payload\\_%' ESCAPE '\\'")]
+    for table in payload_tables:
+        cur.execute(f'''
+                    UPDATE files
+                    SET mtime = NULL
+                    WHERE mtime = 0
+                      AND EXISTS (SELECT 1 FROM {table} p WHERE p.dir_id = files.dir_id AND p.name = files.name)
+                    ''')
+    logger.info("Allowed files without a timestamp")
+
+
+# plugins are re-imported whenever settings change, but the database only needs to be checked once per process
+def ensure_init():
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            init()
+            _schedule_reconcile()
+
+
+def _migrate_flat_table(conn: sqlite3.Connection):
+    logger.info("Migrating table 'timestamps' to directories and files")
+    conn.create_function("dirname", 1, os.path.dirname, deterministic=True)
+    conn.create_function("basename", 1, os.path.basename, deterministic=True)
+    cursor = conn.cursor()
+    # rows without a library can't be queried anyway
+    cursor.execute('''
+                   INSERT OR IGNORE INTO directories (library_id, path)
+                   SELECT DISTINCT library_id, dirname(path)
+                   FROM timestamps
+                   WHERE library_id IS NOT NULL
+                   ''')
+    cursor.execute('''
+                   INSERT OR REPLACE INTO files (dir_id, name, mtime)
+                   SELECT d.id, basename(t.path), t.mtime
+                   FROM timestamps t
+                            JOIN directories d ON d.library_id = t.library_id AND d.path = dirname(t.path)
+                   ''')
+    logger.info(f"Migrated {cursor.rowcount} timestamps")
 
 
 threadlocal = local()
 
+# bumped after every write, tells the panel whether the stored timestamps of a library may have changed
+_generations: dict[int, int] = {}
+_generations_lock = Lock()
+
+
+def _touch(library_ids):
+    with _generations_lock:
+        for library_id in library_ids:
+            _generations[library_id] = _generations.get(library_id, 0) + 1
+
+
+def generation(library_id: int) -> int:
+    """Number of writes to the timestamps of a library since the process started."""
+    return _generations.get(library_id, 0)
+
 
 # we only reuse connection in when file testing, because we currently can't close connections after
 # the scan finishes, these will get closed when going out of scope
 # other threads, such as the post-processor will get a single use connection
 def _get_connection(reuse_connection=False) -> sqlite3.Connection:
+    ensure_init()
     if reuse_connection:
         if not hasattr(threadlocal, "connection"):
             threadlocal.connection = sqlite3.connect(DB_PATH)
@@ -68,51 +271,116 @@ def _get_connection(reuse_connection=False) -> sqlite3.Connection:
         return sqlite3.connect(DB_PATH)
 
 
-def put(library_id: int, path: str, mtime: int):
-    conn = _get_connection()
-    cur = conn.cursor()
+# joins directory and file name in sqlite, which is a lot faster than os.path.join on every row
+_FULL_PATH = "CASE d.path WHEN '/' THEN '/' || f.name ELSE d.path || '/' || f.name END"
+
+
+def _get_dir_id(cur: sqlite3.Cursor, library_id: int, path: str) -> Optional[int]:
+    cur.execute("SELECT id FROM directories WHERE library_id = ? AND path = ?", (library_id, path))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _create_dir_id(cur: sqlite3.Cursor, library_id: int, path: str) -> int:
     cur.execute('''
-                INSERT INTO timestamps (library_id, path, mtime)
-                VALUES (?, ?, ?)
-                ON CONFLICT(library_id, path) DO UPDATE SET mtime = excluded.mtime
-                ''', (library_id, path, mtime))
-    conn.commit()
+                INSERT INTO directories (library_id, path)
+                VALUES (?, ?)
+                ON CONFLICT(library_id, path) DO NOTHING
+                ''', (library_id, path))
+    return _get_dir_id(cur, library_id, path)
+
+
+def put(library_id: int, path: str, mtime: int | Fingerprint):
+    put_many([(library_id, path, mtime)])
 
 
-def put_many(values: list[(int, str, int)]):
+# values are (library_id, path, mtime) where mtime can also be a full fingerprint. storing only the mtime clears size,
+# inode and hash, so they never describe older contents of the file
+@timed("timestamps_put_seconds")
+def put_many(values: list[(int, str, int | Fingerprint)]):
+    get_metrics().inc("timestamp_writes", len(values))
     conn = _get_connection()
-    cur = conn.cursor()
-    cur.executemany('''
-                    INSERT INTO timestamps (library_id, path, mtime)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(library_id, path) DO UPDATE SET mtime = excluded.mtime
-                    ''', values)
-    conn.commit()
+    with conn:
+        cur = conn.cursor()
+        dir_ids = {}
+        rows = []
+        for library_id, path, mtime in values:
+            directory, name = os.path.split(path)
+            dir_id = dir_ids.get((library_id, directory))
+            if dir_id is None:
+                dir_id = _create_dir_id(cur, library_id, directory)
+                dir_ids[(library_id, directory)] = dir_id
+            if not isinstance(mtime, Fingerprint):
+                mtime = Fingerprint(mtime)
+            rows.append((dir_id, name, *mtime))
+        cur.executemany('''
+                        INSERT INTO files (dir_id, name, mtime, size, inode, hash)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(dir_id, name) DO UPDATE SET mtime = excluded.mtime,
+                                                                size  = excluded.size,
+                                                                inode = excluded.inode,
+                                                                hash  = excluded.hash
+                        ''', rows)
+    conn.close()
+    _touch({library_id for library_id, _, _ in values})
 
 
+@timed("timestamps_get_seconds")
 def get(library_id: int, path: str, reuse_connection=False):
     conn = _get_connection(reuse_connection)
     cur = conn.cursor()
-    cur.execute(
-        "SELECT mtime FROM timestamps WHERE library_id = ? AND path = ?", (library_id, path))
+    directory, name = os.path.split(path)
+    cur.execute('''
+                SELECT f.mtime
+                FROM directories d
+                         JOIN files f ON f.dir_id = d.id
+                WHERE d.library_id = ?
+                  AND d.path = ?
+                  AND f.name = ?
+                ''', (library_id, directory, name))
     row = cur.fetchone()
     mtime = row[0] if row else None
     return mtime
 
 
+@timed("timestamps_get_seconds")
+def get_fingerprint(library_id: int, path: str, reuse_connection=False) -> Optional[Fingerprint]:
+    conn = _get_connection(reuse_connection)
+    cur = conn.cursor()
+    directory, name = os.path.split(path)
+    cur.execute('''
+                SELECT f.mtime, f.size, f.inode, f.hash
+                FROM directories d
+                         JOIN files f ON f.dir_id = d.id
+                WHERE d.library_id = ?
+                  AND d.path = ?
+                  AND f.name = ?
+                ''', (library_id, directory, name))
+    row = cur.fetchone()
+    return Fingerprint(*row) if row and row[0] is not None else None
+
+
 # we only allow batch loading with fixed library_id
+# the panel requests the files of one directory at a time, which is a single range scan on the files table
 def get_many(library_id: int, paths: list[str]):
     conn = _get_connection()
     with conn:
         cur = conn.cursor()
+        per_dir = {}
+        for path in paths:
+            directory, _ = os.path.split(path)
+            if directory not in per_dir:
+                dir_id = _get_dir_id(cur, library_id, directory)
+                if dir_id is None:
+                    per_dir[directory] = {}
+                else:
+                    cur.execute("SELECT name, mtime FROM files WHERE dir_id = ?", (dir_id,))
+                    per_dir[directory] = dict(cur)
         mtimes = []
-
-        # I tested this with a temp relation instead of a loop and int was faster at > 15 items per query
         for path in paths:
-            cur.execute(
-                "SELECT mtime FROM timestamps WHERE library_id = ? AND path = ?", (library_id, path))
-            row = cur.fetchone()
-            mtimes.append(row[0] if row else None)
+            directory, name = os.path.split(path)
+            mtimes.append(per_dir[directory].get(name))
+    conn.close()
     return mtimes
 
 
@@ -120,40 +388,539 @@ def get_all_paths(library_id: int = None) -> list[str]:
     conn = _get_connection()
     cur = conn.cursor()
     if library_id:
-        cur.execute('''
-                    SELECT path
-                    FROM timestamps
-                    WHERE library_id = ?
+        cur.execute(f'''
+                    SELECT {_FULL_PATH}
+                    FROM directories d
+                             JOIN files f ON f.dir_id = d.id
+                    WHERE d.library_id = ?
                     ''', (library_id,))
     else:
-        cur.execute('''SELECT DISTINCT path
-                       FROM timestamps''')
+        cur.execute(f'''SELECT DISTINCT {_FULL_PATH}
+                       FROM directories d
+                                JOIN files f ON f.dir_id = d.id''')
     paths = [path[0] for path in cur.fetchall()]
+    conn.close()
     return paths
 
 
 # we directly construct the map here instead of returning a list and creating the map from that
 def get_all(library_id: int) -> Mapping[str, int]:
+    conn = _get_connection()
+    cur = conn.cursor()
+    cur.execute(f'''
+                SELECT {_FULL_PATH}, f.mtime
+                FROM directories d
+                         JOIN files f ON f.dir_id = d.id
+                WHERE d.library_id = ?
+                ''', (library_id,))
+    res = dict(cur)
+    conn.close()
+    return res
+
+
+def count(library_id: int) -> int:
     conn = _get_connection()
     cur = conn.cursor()
     cur.execute('''
-                SELECT path, mtime
-                FROM timestamps
-                WHERE library_id = ?
+                SELECT COUNT(*)
+                FROM directories d
+                         JOIN files f ON f.dir_id = d.id
+                WHERE d.library_id = ?
                 ''', (library_id,))
-    return dict(cur)
+    res = cur.fetchone()[0]
+    conn.close()
+    return res
+
+
+# chunks of paths in no particular order, files removed behind the current directory don't affect the following chunks
+def iter_paths(library_id: int, chunk_size: int = 1000) -> Iterator[list[str]]:
+    chunk = []
+    for path, _ in iter_entries(library_id):
+        chunk.append(path)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# yields (path, mtime) ordered by the full path as plain strings, like walk.walk_sorted, mtime is None for files that
+# only hold catalog payloads. with a prefix only paths below that directory are returned. the directories are loaded
+# up front, files are queried one directory at a time so no read transaction is kept open while the caller consumes
+# the rows
+def iter_entries(library_id: int, prefix: str = None) -> Iterator[Tuple[str, int]]:
+    conn = _get_connection()
+    try:
+        cur = conn.cursor()
+        if prefix is None:
+            root = "/"
+            cur.execute("SELECT path, id FROM directories WHERE library_id = ?", (library_id,))
+        else:
+            args = _subtree_args(library_id, prefix)
+            root = args[1]
+            cur.execute('''
+                        SELECT path, id
+                        FROM directories
+                        WHERE library_id = ?
+                          AND (path = ? OR (path > ? AND path < ?))
+                        ''', args)
+        dir_ids = dict(cur.fetchall())
+
+        # directories without files of their own are not stored, but we still need to visit them
+        children: dict[str, set[str]] = {}
+        for path in dir_ids:
+            while path != root:
+                parent, name = os.path.split(path)
+                siblings = children.setdefault(parent, set())
+                if name in siblings or parent == path:
+                    break
+                siblings.add(name)
+                path = parent
+
+        def visit(path: str) -> Iterator[Tuple[str, int]]:
+            entries = [(name + "/", None) for name in children.get(path, ())]
+            dir_id = dir_ids.get(path)
+            if dir_id is not None:
+                cur.execute("SELECT name, mtime FROM files WHERE dir_id = ?", (dir_id,))
+                entries += cur.fetchall()
+            entries.sort(key=lambda entry: entry[0])
+            for name, mtime in entries:
+                if name.endswith("/"):
+                    yield from visit(os.path.join(path, name[:-1]))
+                else:
+                    yield os.path.join(path, name), mtime
+
+        yield from visit(root)
+    finally:
+        conn.close()
+
+
+# the directories at or below path. "/" is followed by "0" in the byte order sqlite compares text in, so this is a
+# single range on the unique index of directories
+_SUBTREE_DIRS = '''
+                SELECT id
+                FROM directories
+                WHERE library_id = ?
+                  AND (path = ? OR (path > ? AND path < ?))
+                '''
+
+
+def _subtree_args(library_id: int, path: str) -> Tuple[int, str, str, str]:
+    path = path.rstrip("/") or "/"
+    return library_id, path, path.rstrip("/") + "/", path.rstrip("/") + "0"
+
+
+# size and hash are cleared as well, otherwise the file would still be detected as unchanged by its content
+_RESET = "mtime = 0, size = NULL, inode = NULL, hash = NULL"
+
+
+def reset_prefixes(library_id: int, paths: list[str]) -> int:
+    """Set the timestamp of the stored files at or below each path to 0, without touching the disk.
+
+    Returns the number of reset rows. Files without a row or without a timestamp are already treated as changed, so
+    there is nothing to do for them."""
+    conn = _get_connection()
+    num_reset = 0
+    with conn:
+        cur = conn.cursor()
+        for path in paths:
+            cur.execute(f"UPDATE files SET {_RESET} WHERE dir_id IN ({_SUBTREE_DIRS}) AND mtime IS NOT NULL",
+                        _subtree_args(library_id, path))
+            num_reset += cur.rowcount
+            directory, name = os.path.split(path)
+            cur.execute(f'''
+                        UPDATE files
+                        SET {_RESET}
+                        WHERE dir_id = (SELECT id FROM directories WHERE library_id = ? AND path = ?)
+                          AND name = ?
+                          AND mtime IS NOT NULL
+                        ''', (library_id, directory, name))
+            num_reset += cur.rowcount
+    conn.close()
+    _touch([library_id])
+    return num_reset
+
+
+def remove_prefixes(library_id: int, paths: list[str]) -> int:
+    """Remove the stored files at or below each path. Returns the number of removed rows."""
+    conn = _get_connection()
+    num_removed = 0
+    with conn:
+        cur = conn.cursor()
+        for path in paths:
+            args = _subtree_args(library_id, path)
+            cur.execute(f"DELETE FROM files WHERE dir_id IN ({_SUBTREE_DIRS})", args)
+            num_removed += cur.rowcount
+            cur.execute(f"DELETE FROM directories WHERE id IN ({_SUBTREE_DIRS})", args)
+            directory, name = os.path.split(path)
+            dir_id = _get_dir_id(cur, library_id, directory)
+            if dir_id is not None:
+                cur.execute("DELETE FROM files WHERE dir_id = ? AND name = ?", (dir_id, name))
+                num_removed += cur.rowcount
+                cur.execute('''
+                            DELETE
+                            FROM directories
+                            WHERE id = ?
+                              AND NOT EXISTS (SELECT 1 FROM files WHERE dir_id = ?)
+                            ''', (dir_id, dir_id))
+    conn.close()
+    _touch([library_id])
+    return num_removed
 
 
 def remove_paths(library_id: int, paths: list[str]):
     conn = _get_connection()
-    cur = conn.cursor()
-    # one by one is good enough for now, I don't think we can use CTEs from python
     with conn:
+        cur = conn.cursor()
+        dir_ids = {}
+        rows = []
         for path in paths:
-            cur.execute('''
+            directory, name = os.path.split(path)
+            if directory not in dir_ids:
+                dir_ids[directory] = _get_dir_id(cur, library_id, directory)
+            if dir_ids[directory] is not None:
+                rows.append((dir_ids[directory], name))
+        cur.executemany("DELETE FROM files WHERE dir_id = ? AND name = ?", rows)
+        # drop directories that are empty now
+        cur.executemany('''
                         DELETE
-                        FROM timestamps
-                        WHERE library_id = ?
-                          AND path = ?
-                        ''', (library_id, path))
-        conn.commit()
\ No newline at end of file
+                        FROM directories
+                        WHERE id = ?
+                          AND NOT EXISTS (SELECT 1 FROM files WHERE dir_id = ?)
+                        ''', ((dir_id, dir_id) for dir_id in dir_ids.values() if dir_id is not None))
+    conn.close()
+    _touch([library_id])
+
+
+# paths from requests and import files must not leave the root they are joined with
+def _is_contained(relative: str) -> bool:
+    return not relative.startswith("/") and ".." not in relative.split("/")
+
+
+def rewrite_prefix(library_id: int, old: str, new: str, within: str = None) -> int:
+    """Move the stored directories at or below old to new, e.g. after a library was mounted somewhere else.
+
+    Only directory paths change, files keep their rows. With within set, new has to be at or below it. Returns the
+    number of moved directories."""
+    old = old.rstrip("/")
+    new = new.rstrip("/")
+    if old == "" or new == "":
+        raise ValueError("Can't rewrite the root directory")
+    for path in (old, new):
+        if not path.startswith("/") or not _is_contained(path.lstrip("/")):
+            raise ValueError(f"Invalid path: {path}")
+    if within is not None:
+        within = within.rstrip("/")
+        if new != within and not new.startswith(within + "/"):
+            raise ValueError(f"{new} is not below {within}")
+    if old == new:
+        return 0
+    if new.startswith(old + "/") or old.startswith(new + "/"):
+        raise ValueError("Can't rewrite a directory to one of its own subdirectories or parents")
+
+    args = _subtree_args(library_id, old)
+    conn = _get_connection()
+    with conn:
+        cur = conn.cursor()
+        cur.execute(f'''
+                    SELECT path
+                    FROM directories
+                    WHERE library_id = ?
+                      AND path IN (SELECT ? || substr(path, ?) FROM directories WHERE id IN ({_SUBTREE_DIRS}))
+                    LIMIT 1
+                    ''', (library_id, new, len(old) + 1, *args))
+        row = cur.fetchone()
+        if row is not None:
+            raise ValueError(f"{row[0]} already has timestamps, forget them before rewriting")
+        cur.execute(f"UPDATE directories SET path = ? || substr(path, ?) WHERE id IN ({_SUBTREE_DIRS})",
+                    (new, len(old) + 1, *args))
+        num_moved = cur.rowcount
+    conn.close()
+    _touch([library_id])
+    return num_moved
+
+
+EXPORT_FORMAT = "kmarius_incremental_scan/timestamps"
+EXPORT_VERSION = 1
+
+
+# an export is a header line followed by one line per directory holding its path relative to the exported root and
+# the rows of its files as [name, mtime, size, inode, hash]. reset files (mtime 0) and files without a timestamp are
+# left out
+def export_entries(library_id: int, file: TextIO, root: str) -> int:
+    """Write the stored files at or below root to file. Returns the number of exported files."""
+    args = _subtree_args(library_id, root)
+    root = args[1]
+    file.write(json.dumps({"format": EXPORT_FORMAT, "version": EXPORT_VERSION, "library_id": library_id,
+                           "root": root}) + "\n")
+    num_exported = 0
+    conn = _get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+                    SELECT id, path
+                    FROM directories
+                    WHERE library_id = ?
+                      AND (path = ? OR (path > ? AND path < ?))
+                    ORDER BY path
+                    ''', args)
+        for dir_id, path in cur.fetchall():
+            cur.execute("SELECT name, mtime, size, inode, hash FROM files WHERE dir_id = ? AND mtime != 0 "
+                        "ORDER BY name", (dir_id,))
+            rows = cur.fetchall()
+            if len(rows) > 0:
+                relative = path[len(root.rstrip("/")):].lstrip("/")
+                file.write(json.dumps([relative, rows], separators=(",", ":")) + "\n")
+                num_exported += len(rows)
+    finally:
+        conn.close()
+    return num_exported
+
+
+def import_entries(library_id: int, file: TextIO, root: str = None, chunk_size: int = 1000,
+                   within: str = None) -> int:
+    """Store the files of an export below root, by default the exported root. Returns the number of imported files.
+
+    With within set, the root has to be at or below it."""
+    header = json.loads(file.readline())
+    if header.get("format") != EXPORT_FORMAT or header.get("version") != EXPORT_VERSION:
+        raise ValueError("Not an export of kmarius_incremental_scan timestamps")
+    root = (root or header["root"]).rstrip("/") or "/"
+    if not root.startswith("/") or not _is_contained(root.lstrip("/")):
+        raise ValueError(f"Invalid root: {root}")
+    if within is not None:
+        within = within.rstrip("/")
+        if root != within and not root.startswith(within + "/"):
+            raise ValueError(f"{root} is not below {within}")
+
+    num_imported = 0
+    values = []
+    for line in file:
+        relative, rows = json.loads(line)
+        if not _is_contained(relative):
+            raise ValueError(f"Invalid directory in export: {relative}")
+        directory = os.path.join(root, relative) if relative else root
+        for name, *fields in rows:
+            if name in ("", ".", "..") or "/" in name:
+                raise ValueError(f"Invalid file name in export: {name}")
+            values.append((library_id, os.path.join(directory, name), Fingerprint(*fields)))
+        if len(values) >= chunk_size:
+            put_many(values)
+            num_imported += len(values)
+            values = []
+    if len(values) > 0:
+        put_many(values)
+        num_imported += len(values)
+    return num_imported
+
+
+class Rollup(NamedTuple):
+    files: int
+    processed: int
+    pending: int
+    bytes: int
+
+
+def get_rollups(library_id: int, paths: list[str]) -> list[Rollup]:
+    """Rollups of the directories at or below each path, summed up per path."""
+    res = []
+    conn = _get_connection()
+    cur = conn.cursor()
+    for path in paths:
+        cur.execute(f'''
+                    SELECT coalesce(sum(files), 0),
+                           coalesce(sum(processed), 0),
+                           coalesce(sum(pending), 0),
+                           coalesce(sum(bytes), 0)
+                    FROM rollups
+                    WHERE dir_id IN ({_SUBTREE_DIRS})
+                    ''', _subtree_args(library_id, path))
+        res.append(Rollup(*cur.fetchone()))
+    conn.close()
+    return res
+
+
+_COMPUTED_ROLLUPS = '''
+                    SELECT dir_id,
+                           count(mtime),
+                           coalesce(sum(mtime != 0), 0),
+                           coalesce(sum(mtime = 0), 0),
+                           coalesce(sum(CASE WHEN mtime IS NULL THEN 0 ELSE coalesce(size, 0) END), 0)
+                    FROM files
+                    GROUP BY dir_id
+                    '''
+
+
+def _reconcile_rollups(cur: sqlite3.Cursor) -> int:
+    cur.execute(f"SELECT count(*) FROM ({_COMPUTED_ROLLUPS} EXCEPT SELECT * FROM rollups)")
+    num_off = cur.fetchone()[0]
+    cur.execute("DELETE FROM rollups")
+    cur.execute(f"INSERT INTO rollups (dir_id, files, processed, pending, bytes) {_COMPUTED_ROLLUPS}")
+    return num_off
+
+
+def reconcile_rollups() -> int:
+    """Recompute all rollups from the stored files. Returns the number of directories whose rollup was off."""
+    conn = _get_connection()
+    with conn:
+        num_off = _reconcile_rollups(conn.cursor())
+    conn.close()
+    return num_off
+
+
+def _reconcile_periodically():
+    try:
+        num_off = reconcile_rollups()
+        if num_off > 0:
+            logger.warning(f"Reconciled the rollups of {num_off} directories")
+    except Exception as e:
+        logger.error(f"Could not reconcile rollups: {e}")
+    _schedule_reconcile()
+
+
+def _schedule_reconcile():
+    timer = Timer(RECONCILE_INTERVAL, _reconcile_periodically)
+    timer.daemon = True
+    timer.start()
+
+
+def has_search_index() -> bool:
+    ensure_init()
+    return _search_available
+
+
+def set_search_index(enabled: bool) -> bool:
+    """Build or drop the search index. Returns whether the index exists afterwards."""
+    ensure_init()
+    with _search_lock:
+        return _set_search_index(enabled)
+
+
+def _set_search_index(enabled: bool) -> bool:
+    global _search_available
+    if enabled == _search_available:
+        return _search_available
+    conn = _get_connection()
+    try:
+        with conn:
+            cur = conn.cursor()
+            if enabled:
+                cur.execute("CREATE VIRTUAL TABLE search USING fts5(path, tokenize = 'trigram')")
+                cur.execute('''
+                            CREATE TABLE search_rows
+                            (
+                                id     INTEGER PRIMARY KEY,
+                                dir_id INTEGER NOT NULL,
+                                name   TEXT    NOT NULL,
+                                UNIQUE (dir_id, name)
+                            )''')
+                for trigger in _SEARCH_TRIGGERS:
+                    cur.execute(trigger)
+                cur.execute("INSERT INTO search_rows (dir_id, name) SELECT dir_id, name FROM files")
+                cur.execute(f'''
+                            INSERT INTO search (rowid, path)
+                            SELECT s.id, {_FULL_PATH.replace("f.name", "s.name")}
+                            FROM search_rows s
+                                     JOIN directories d ON d.id = s.dir_id
+                            ''')
+                logger.info(f"Indexed {cur.rowcount} paths for search")
+            else:
+                for trigger in ["search_insert", "search_delete", "search_directories_update"]:
+                    cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                cur.execute("DROP TABLE IF EXISTS search")
+                cur.execute("DROP TABLE IF EXISTS search_rows")
+                logger.info("Dropped the search index")
+        _search_available = enabled
+    except sqlite3.OperationalError as e:
+        logger.error(f"Could not create the search index, search falls back to scanning all paths: {e}")
+    finally:
+        conn.close()
+    return _search_available
+
+
+def _escape_like(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search(query: str, library_id: int = None, limit: int = 100) -> list[Tuple[int, str, int]]:
+    """Stored files whose path contains every whitespace separated term of query, case-insensitively, ordered by path.
+
+    Returns (library_id, path, mtime) tuples."""
+    ensure_init()
+    terms = query.split()
+    if len(terms) == 0:
+        return []
+    # the trigram index can't match terms shorter than three characters
+    fts_terms = [term for term in terms if len(term) >= 3] if _search_available else []
+    like_terms = [term for term in terms if term not in fts_terms]
+
+    conditions = []
+    args = []
+    if len(fts_terms) > 0:
+        tables = '''
+                 search
+                     JOIN search_rows s ON s.id = search.rowid
+                     JOIN files f ON f.dir_id = s.dir_id AND f.name = s.name
+                     JOIN directories d ON d.id = f.dir_id
+                 '''
+        conditions.append("search MATCH ?")
+        args.append(" ".join('"' + term.replace('"', '""') + '"' for term in fts_terms))
+    else:
+        tables = "files f JOIN directories d ON d.id = f.dir_id"
+    for term in like_terms:
+        conditions.append(f"{_FULL_PATH} LIKE ? ESCAPE '\\'")
+        args.append(_escape_like(term))
+    if library_id is not None:
+        conditions.append("d.library_id = ?")
+        args.append(library_id)
+
+    conn = _get_connection()
+    cur = conn.cursor()
+    cur.execute(f'''
+                SELECT d.library_id, {_FULL_PATH} AS full_path, f.mtime
+                FROM {tables}
+                WHERE {" AND ".join(conditions)}
+                ORDER BY full_path
+                LIMIT ?
+                ''', (*args, limit))
+    res = cur.fetchall()
+    conn.close()
+    return res
+
+
+def recent(library_id: int = None, limit: int = 100, cursor: str = None,
+           since: int = 0) -> Tuple[list[Tuple[int, str, int]], Optional[str]]:
+    """Stored files with a timestamp after since, most recent first, without reset entries.
+
+    Returns (library_id, path, mtime) tuples and a cursor to fetch the next page, if there are more entries."""
+    ensure_init()
+    conditions = ["f.mtime > ?"]
+    args = [since]
+    # the cursor is the key of the last entry of the previous page
+    if cursor:
+        mtime, dir_id, name = cursor.split(":", 2)
+        conditions.append("(f.mtime, f.dir_id, f.name) < (?, ?, ?)")
+        args += [int(mtime), int(dir_id), name]
+    if library_id is not None:
+        conditions.append("d.library_id = ?")
+        args.append(library_id)
+
+    conn = _get_connection()
+    cur = conn.cursor()
+    cur.execute(f'''
+                SELECT d.library_id, {_FULL_PATH}, f.mtime, f.dir_id, f.name
+                FROM files f INDEXED BY files_mtime
+                         JOIN directories d ON d.id = f.dir_id
+                WHERE {" AND ".join(conditions)}
+                ORDER BY f.mtime DESC, f.dir_id DESC, f.name DESC
+                LIMIT ?
+                ''', (*args, limit + 1))
+    rows = cur.fetchall()
+    conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        _, _, mtime, dir_id, name = rows[-1]
+        next_cursor = f"{mtime}:{dir_id}:{name}"
+    return [row[:3] for row in rows], next_cursor
@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterator, NamedTuple, Optional, Tuple
+
+from . import logger
+
+
+class FileInfo(NamedTuple):
+    name: str
+    mtime: int
+    size: int
+
+
+class DirListing(NamedTuple):
+    dirs: list[str]
+    files: list[FileInfo]
+
+
+def scan_dir(path: str, prune_dir: Optional[Callable[[str], bool]] = None,
+             include_file: Optional[Callable[[str], bool]] = None, include_hidden=False) -> DirListing:
+    """List a single directory. Files are stat-ed through their DirEntry."""
+    dirs = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            name = entry.name
+            if not include_hidden and name.startswith("."):
+                continue
+            abspath = os.path.join(path, name)
+            if entry.is_dir():
+                if not (prune_dir and prune_dir(abspath)):
+                    dirs.append(name)
+            elif not include_file or include_file(abspath):
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    logger.error(f"{e}")
+                    continue
+                files.append(FileInfo(name, int(stat.st_mtime), int(stat.st_size)))
+    return DirListing(dirs, files)
+
+
+def filter_listing(path: str, listing: DirListing, prune_dir: Optional[Callable[[str], bool]] = None,
+                   include_file: Optional[Callable[[str], bool]] = None, include_hidden=False) -> DirListing:
+    """Apply the same filters as scan_dir to an existing listing."""
+    dirs = [name for name in listing.dirs
+            if (include_hidden or not name.startswith("."))
+            and not (prune_dir and prune_dir(os.path.join(path, name)))]
+    files = [file for file in listing.files
+             if (include_hidden or not file.name.startswith("."))
+             and (not include_file or include_file(os.path.join(path, file.name)))]
+    return DirListing(dirs, files)
+
+
+def walk_parallel(root: str, max_workers: int = 8, prune_dir: Optional[Callable[[str], bool]] = None,
+                  include_file: Optional[Callable[[str], bool]] = None, include_hidden=False,
+                  list_dir: Optional[Callable[[str], DirListing]] = None,
+                  cancelled: Optional[Callable[[], bool]] = None) -> dict[str, DirListing]:
+    """Scan the directory tree below root, listing sibling directories concurrently.
+
+    list_dir replaces scanning the filesystem, e.g. to serve listings from a cache. Returns a listing for every visited
+    directory keyed by its path, directories that could not be read are missing.
+    """
+
+    def list_filtered(path: str) -> DirListing:
+        if list_dir is None:
+            return scan_dir(path, prune_dir, include_file, include_hidden)
+        return filter_listing(path, list_dir(path), prune_dir, include_file, include_hidden)
+
+    listings = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(list_filtered, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    listing = future.result()
+                except OSError as e:
+                    logger.error(f"{e}")
+                    continue
+                listings[path] = listing
+                if cancelled and cancelled():
+                    continue
+                for name in listing.dirs:
+                    child = os.path.join(path, name)
+                    pending[pool.submit(list_filtered, child)] = child
+    return listings
+
+
+def walk_sorted(root: str, list_dir: Optional[Callable[[str], DirListing]] = None,
+                prune_dir: Optional[Callable[[str], bool]] = None,
+                include_file: Optional[Callable[[str], bool]] = None,
+                include_hidden=False) -> Iterator[Tuple[str, FileInfo]]:
+    """Yield (path, file info) for all files below root, ordered by their full path as plain strings.
+
+    A directory sorts as its name followed by "/", so "a.mkv" comes before the contents of "a/". The order matches
+    ORDER BY path in sqlite, which allows merging a walk with the stored rows in a single pass.
+    """
+
+    def list_filtered(path: str) -> DirListing:
+        if list_dir is None:
+            return scan_dir(path, prune_dir, include_file, include_hidden)
+        return filter_listing(path, list_dir(path), prune_dir, include_file, include_hidden)
+
+    def visit(path: str) -> Iterator[Tuple[str, FileInfo]]:
+        try:
+            listing = list_filtered(path)
+        except OSError as e:
+            logger.error(f"{e}")
+            return
+        entries = [(name + "/", None) for name in listing.dirs]
+        entries += [(file_info.name, file_info) for file_info in listing.files]
+        entries.sort(key=lambda entry: entry[0])
+        for key, file_info in entries:
+            if file_info is None:
+                yield from visit(os.path.join(path, key[:-1]))
+            else:
+                yield os.path.join(path, key), file_info
+
+    yield from visit(root)
@@ -1,11 +1,12 @@
 import os
+import threading
 from typing import override
 
 from unmanic.libs.unmodels import Libraries
 from unmanic.libs.unplugins.settings import PluginSettings
 
 from kmarius_incremental_scan.lib.plugin_types import *
-from kmarius_incremental_scan.lib import timestamps, PLUGIN_ID, logger
+from kmarius_incremental_scan.lib import catalog, fingerprint, metrics, timestamps, PLUGIN_ID, logger
 from kmarius_incremental_scan.lib.panel import Panel
 
 
@@ -121,6 +122,71 @@ class Settings(PluginSettings):
             },
         })
 
+        settings.update({
+            "change_detection": "mtime",
+        })
+        form_settings.update({
+            "change_detection": {
+                "label": "Change detection",
+                "description": "What happens when the modification time of a file differs from the stored one. Comparing contents avoids processing files again that were only touched, restored from a backup or copied again. Size and hash are stored the next time a file is tested or processed.",
+                "input_type": "select",
+                "select_options": [
+                    {"value": "mtime", "label": "Treat the file as changed"},
+                    {"value": "hash", "label": "Unchanged if size and a hash of sampled blocks are the same"},
+                ],
+            },
+        })
+
+        settings.update({
+            "prune_mode": "stat",
+        })
+        form_settings.update({
+            "prune_mode": {
+                "label": "Pruning strategy",
+                "description": "How the data panel finds orphaned database entries. Walking the library is usually faster on network shares with many entries.",
+                "input_type": "select",
+                "select_options": [
+                    {"value": "stat", "label": "Check every stored path"},
+                    {"value": "walk", "label": "Compare against a single walk of the library"},
+                ],
+            },
+        })
+
+        settings.update({
+            "watch_libraries": False,
+        })
+        form_settings.update({
+            "watch_libraries": {
+                "label": "Watch libraries for changes",
+                "description": "The data panel caches directory listings and only rescans directories whose modification time changed. Enable this to also pick up files modified in place via inotify. Uses one inotify watch per directory.",
+            },
+        })
+
+        settings.update({
+            "search_index": False,
+        })
+        form_settings.update({
+            "search_index": {
+                "label": "Index paths for search",
+                "description": "Keep a trigram index of all stored paths so searching the data panel stays fast in large libraries. Makes the database several times larger and writing timestamps slower. Without it, search scans all stored paths.",
+            },
+        })
+
+        settings.update({
+            "panel_job_workers": 1,
+        })
+        form_settings.update({
+            "panel_job_workers": {
+                "label": "Number of data panel jobs that run at the same time",
+                "description": "Testing, processing, pruning and updating timestamps from the data panel are queued as jobs.",
+                "input_type": "slider",
+                "slider_options": {
+                    "min": 1,
+                    "max": 8,
+                },
+            },
+        })
+
         library_ids = [lib[0] for lib in libraries]
         return settings, form_settings, library_ids
 
@@ -163,33 +229,84 @@ class Settings(PluginSettings):
         return True
 
 
-timestamps.init()
-panel = Panel(Settings)
-settings = Settings()
+# unmanic re-imports this module whenever settings change, so the panel and settings are only built on first use.
+# the database is initialized once per process by the timestamps module
+_lock = threading.Lock()
+_panel: Panel | None = None
+_settings: Settings | None = None
 
 
-def is_file_unchanged(library_id: int, path: str) -> bool:
-    mtime = int(os.path.getmtime(path))
-    stored_timestamp = timestamps.get(library_id, path, reuse_connection=True)
-    return stored_timestamp == mtime
+def get_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
 
 
-def update_timestamp(library_id: int, path: str) -> int | None:
-    try:
-        mtime = int(os.path.getmtime(path))
-        timestamps.put(library_id, path, mtime)
-        return mtime
-    except Exception as e:
-        logger.error(e)
+def get_panel() -> Panel:
+    global _panel
+    if _panel is None:
+        with _lock:
+            if _panel is None:
+                _panel = Panel(Settings)
+    return _panel
+
+
+def is_file_unchanged(library_id: int, path: str, change_detection: str = "mtime",
+                      entry: catalog.Entry | None = None) -> bool:
+    mtime = int(os.path.getmtime(path))
+    if entry is None:
+        stored = timestamps.get_fingerprint(library_id, path, reuse_connection=True)
+    else:
+        stored = entry.fingerprint
+    if stored is None:
+        return False
+    if stored.mtime == mtime:
+        return True
+    if change_detection == "mtime":
+        return False
+
+    # the file was touched, check if its content changed
+    current = fingerprint.fingerprint(path)
+    if not fingerprint.is_same_content(stored, current, change_detection, path):
+        return False
+    timestamps.put(library_id, path, current._replace(hash=stored.hash))
+    metrics.get_metrics().inc("files_skipped_content")
+    return True
+
+
+def update_timestamps(library_id: int, paths: list[str]) -> list[tuple[str, int]]:
+    """Store fingerprints of all paths in a single transaction, returns the paths and mtimes that were stored."""
+    with_hash = get_settings().get_setting("change_detection") == "hash"
+    values = []
+    for path in paths:
+        try:
+            values.append((library_id, path, fingerprint.fingerprint(path, with_hash=with_hash)))
+        except Exception as e:
+            logger.error(f"Failed to stat {path}: {e}")
+    if len(values) == 0:
+        return []
+    timestamps.put_many(values)
+    return [(path, current.mtime) for _, path, current in values]
 
 
 def on_library_management_file_test(data: FileTestData):
     library_id = data.get('library_id')
     path = data.get("path")
 
+    settings = get_settings()
     quiet = settings.get_setting("quiet_incremental_scan")
+    change_detection = settings.get_setting("change_detection")
+
+    # if another plugin keeps payloads in the catalog, look them up along with the fingerprint and pass them on
+    providers = sorted(catalog.get_providers())
+    entry = catalog.lookup(library_id, path, providers, reuse_connection=True) if providers else None
 
-    if is_file_unchanged(library_id, path):
+    metrics.get_metrics().inc("files_checked")
+    if is_file_unchanged(library_id, path, change_detection, entry):
+        metrics.get_metrics().inc("files_skipped")
         if not quiet:
             data["issues"].append({
                 'id': PLUGIN_ID,
@@ -197,29 +314,34 @@ def on_library_management_file_test(data: FileTestData):
             })
         data['add_file_to_pending_tasks'] = False
     else:
+        metrics.get_metrics().inc("files_passed")
         data["shared_info"]["quiet_incremental_scan"] = quiet
+        data["shared_info"]["incremental_scan_change_detection"] = change_detection
+        if entry is not None:
+            data["shared_info"][catalog.SHARED_INFO_KEY] = catalog.handoff(library_id, path, entry)
 
 
 def on_postprocessor_task_results(data: TaskResultData):
     # we are assuming here that all output files belong to the same library
     # and that we don't want to test it again in the future
 
-    quiet = settings.get_setting("quiet_incremental_scan")
+    quiet = get_settings().get_setting("quiet_incremental_scan")
 
     if data["task_processing_success"] and data["file_move_processes_success"]:
         library_id = data["library_id"]
-        for path in data["destination_files"]:
-            try:
-                mtime = update_timestamp(library_id, path)
-                if mtime and not quiet:
-                    logger.info(f"Updated timestamp library_id={library_id} path={path} to {mtime}")
-            except Exception as e:
-                logger.error(e)
+        try:
+            updated = update_timestamps(library_id, data["destination_files"])
+        except Exception as e:
+            logger.error(e)
+            return
+        if not quiet:
+            for path, mtime in updated:
+                logger.info(f"Updated timestamp library_id={library_id} path={path} to {mtime}")
 
 
 def render_frontend_panel(data: PanelData):
-    panel.render_frontend_panel(data)
+    get_panel().render_frontend_panel(data)
 
 
 def render_plugin_api(data: PluginApiData):
-    panel.render_plugin_api(data)
\ No newline at end of file
+    get_panel().render_plugin_api(data)
\ No newline at end of file